@@ -0,0 +1,121 @@
+import os
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from gspread.utils import ValueInputOption
+from gspread.exceptions import WorksheetNotFound
+from common_processor import load_the_spreadsheet, read_columns, contiguous_runs
+from progress import notify
+from leases import sheet_lease, check_leases
+from tenants import tenant_path
+
+ARCHIVE_DIR = 'archive'
+
+# Growing worksheets that are rolled over -> date column deciding the age of a row
+ROLLOVER_SHEETS = {'주문': '기록 날짜', '배송': '기록 날짜'}
+
+# Rows older than this many days are moved out of the live worksheets
+DEFAULT_HORIZON_DAYS = int(os.environ.get('ROLLOVER_HORIZON_DAYS', 90))
+
+
+def archive_sheet_name(sheet_name):
+    return f'{sheet_name} 보관'
+
+def _archive_to_parquet(sheet_name, rows, archive_dir):
+    """Store archived rows exactly as they were in the sheet, as strings"""
+    sheet_dir = os.path.join(archive_dir, sheet_name)
+    os.makedirs(sheet_dir, exist_ok=True)
+    path = os.path.join(sheet_dir, f"part-{pd.Timestamp.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}.parquet")
+    table = pa.Table.from_pandas(rows.astype(str), preserve_index=False)
+    pq.write_table(table, path, compression='zstd')
+
+def _archive_to_sheet(sh, sheet_name, rows):
+    """Append archived rows to the '<sheet> 보관' worksheet, creating it when missing"""
+    title = archive_sheet_name(sheet_name)
+    try:
+        worksheet = sh.worksheet(title)
+    except WorksheetNotFound:
+        worksheet = sh.add_worksheet(title=title, rows=1, cols=len(rows.columns))
+        worksheet.append_rows([list(rows.columns)], value_input_option=ValueInputOption.raw)
+    worksheet.append_rows(rows.values.tolist(), value_input_option=ValueInputOption.raw,
+                          insert_data_option='INSERT_ROWS', table_range='A1')
+
+def rollover(sh, sheet_name, horizon_days=DEFAULT_HORIZON_DAYS, target='parquet',
+             archive_dir=None):
+    """
+    Move rows older than the horizon out of a live worksheet
+
+    Rows are archived first and only then deleted from the live sheet, so an
+    interruption can duplicate rows between the two parts but never lose
+    them. Rows with an unparseable date stay live.
+
+    Args:
+        target (str): 'parquet' for local files under archive_dir, 'sheet' for
+            a '<sheet> 보관' worksheet in the same spreadsheet
+
+    Returns:
+        int: Number of rows moved
+    """
+    archive_dir = archive_dir or tenant_path(ARCHIVE_DIR)
+    worksheet = sh.worksheet(sheet_name)
+    values = worksheet.get_all_values()
+    df = pd.DataFrame(values[1:], columns=values[0])
+    dates = pd.to_datetime(df[ROLLOVER_SHEETS[sheet_name]], errors='coerce')
+    cutoff = pd.Timestamp.now().normalize() - pd.Timedelta(days=horizon_days)
+    old = (dates < cutoff).to_numpy()
+    if not old.any():
+        return 0
+
+    rows = df[old]
+    if target == 'sheet':
+        _archive_to_sheet(sh, sheet_name, rows)
+    else:
+        _archive_to_parquet(sheet_name, rows, archive_dir)
+
+    # Old rows are normally one block at the top; delete bottom-up so row numbers stay valid
+    # (sheet rows are 1-based and the header takes the first row)
+    for first, last in reversed(contiguous_runs(list(old.nonzero()[0]))):
+        check_leases()
+        worksheet.delete_rows(first + 2, last + 2)
+    return len(rows)
+
+def rollover_sheets(sh, horizon_days=DEFAULT_HORIZON_DAYS, target='parquet'):
+    """Roll over every growing worksheet and report the result"""
+    for sheet_name in ROLLOVER_SHEETS:
+        # Rows are deleted by position, so two rollovers must not interleave
+        with sheet_lease(sh, sheet_name):
+            moved = rollover(sh, sheet_name, horizon_days, target)
+        notify('success', f'{sheet_name}: {moved} 행 보관 완료 ({horizon_days}일 이전)')
+
+def read_unified(sheet_name, sh, columns=None, archive_dir=None):
+    """
+    Read a rolled-over worksheet as one DataFrame: archived rows first, then live rows
+
+    Both archive targets are included, so switching targets keeps history
+    readable. Columns follow the live sheet's header.
+
+    Args:
+        columns (list): Read only these columns, e.g. the key columns for
+            deduplication; parquet parts and worksheets are read projected
+    """
+    archive_dir = archive_dir or tenant_path(ARCHIVE_DIR)
+
+    def read_sheet(title):
+        return load_the_spreadsheet(title, sh) if columns is None else read_columns(title, sh, columns)
+
+    live_df = read_sheet(sheet_name)
+    parts = []
+
+    sheet_dir = os.path.join(archive_dir, sheet_name)
+    if os.path.isdir(sheet_dir) and os.listdir(sheet_dir):
+        parts.append(pq.read_table(sheet_dir, columns=columns).to_pandas())
+    try:
+        sh.worksheet(archive_sheet_name(sheet_name))
+        parts.append(read_sheet(archive_sheet_name(sheet_name)))
+    except WorksheetNotFound:
+        pass
+
+    parts.append(live_df)
+    return pd.concat([part.reindex(columns=live_df.columns) for part in parts],
+                     ignore_index=True).fillna('')
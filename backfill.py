@@ -0,0 +1,201 @@
+"""
+Reprocess a directory of archived exports in bulk
+
+Used after a platform mapping or processor fix, when months of exports
+have to go through the processors again:
+
+    python backfill.py archive/exports/2026-05 --processes 8
+
+Files are parsed and transformed in a process pool, keys are deduplicated
+across all files and against the sheets (archived rows included), and the
+rows are appended once per worksheet in a deterministic order.
+"""
+import io
+import os
+import argparse
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from common_processor import read_columns, update_worksheet, CUSTOMER_KEY_COLUMNS
+from platforms import PLATFORMS, get_processor, read_upload, detect_platform
+from progress import RunReporter, notify, run_reported
+from validation import validate_upload
+from sheets_io import read_sheets
+from leases import sheet_lease
+from archive import read_unified
+
+EXPORT_EXTENSIONS = ('.xlsx', '.xls')
+
+# Rows per append request, keeping each request well under the API payload limit
+WRITE_CHUNK_ROWS = 5000
+
+# Stage -> (worksheet, key columns), in write order
+TARGETS = {
+    'customer': ('고객', ['고객 휴대폰', '플랫폼']),
+    'order': ('주문', ['주문 key']),
+    'delivery': ('배송', ['배송 key']),
+}
+
+# Reference rows shared by the transforms, set once per pool process
+_reference = {}
+
+
+class ConsoleReporter(RunReporter):
+    """Prints progress messages, for runs outside the app"""
+
+    def add_event(self, level, message):
+        super().add_event(level, message)
+        print(f"[{level}] {message}", flush=True)
+
+
+def find_exports(directory):
+    """Export files in a directory, sorted so runs over the same files are identical"""
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(EXPORT_EXTENSIONS))
+
+def _init_pool(option_df, customer_df):
+    _reference['옵션'] = option_df
+    _reference['고객'] = customer_df
+
+def transform_file(path, platform=None):
+    """
+    Parse, validate and transform one export inside a pool process
+
+    Returns:
+        tuple: (rows dict or None, list of (level, message) events)
+    """
+    def transform():
+        with open(path, 'rb') as f:
+            file_bytes = f.read()
+        file_platform = platform or detect_platform(file_bytes)
+        if file_platform is None:
+            notify('error', "Could not detect the platform, file skipped")
+            return None
+        df = read_upload(file_platform, io.BytesIO(file_bytes))
+        report = validate_upload(df, file_platform, header_row=PLATFORMS[file_platform].get('header', 0))
+        if not report.empty:
+            notify('error', f"{len(report)} problems found in the file, file skipped")
+            return None
+        return get_processor(file_platform, 'rows')(df, _reference['옵션'], _reference['고객'])
+
+    # Exceptions may not pickle, only the messages are sent back
+    reporter = RunReporter()
+    rows = run_reported(reporter, transform)
+    return rows, [(level, message) for _, level, message in reporter.events]
+
+def new_rows(frames, keys, existing):
+    """
+    Rows of the keys that are neither in existing nor in an earlier frame, sorted by key
+
+    A key can span several rows (an order has one row per order line), so
+    every row of a key is taken from the first frame containing it.
+    """
+    seen = existing.set_index(keys).index
+    parts = []
+    for frame in frames:
+        index = frame.set_index(keys).index
+        fresh = ~index.isin(seen)
+        parts.append(frame[fresh])
+        seen = seen.append(index[fresh].unique())
+    rows = pd.concat(parts, ignore_index=True)
+    return rows.sort_values(keys, kind='stable').reset_index(drop=True)
+
+def merge_rows(file_rows, existing):
+    """
+    Combine the rows of all files, keeping the rows of each key from the first file that has it
+
+    Args:
+        file_rows (list): Rows dicts in file order
+        existing (dict): Stage -> DataFrame of the keys already in the sheets
+
+    Returns:
+        dict: Stage -> new rows sorted by key
+    """
+    return {stage: new_rows([rows[stage] for rows in file_rows], keys, existing[stage])
+            for stage, (_, keys) in TARGETS.items()}
+
+def write_rows(stage, rows, sh):
+    """Append the rows of a stage in chunks, snapshotting them to the history store"""
+    sheet_name, _ = TARGETS[stage]
+    for start in range(0, len(rows), WRITE_CHUNK_ROWS):
+        chunk = rows.iloc[start:start + WRITE_CHUNK_ROWS]
+        update_worksheet(chunk, sheet_name,
+                         f'{sheet_name} {start + len(chunk)}/{len(rows)} 행 백필 완료', sh,
+                         history_kind=stage)
+
+def backfill(directory, sh, platform=None, processes=None, dry_run=False):
+    """
+    Reprocess every export in a directory and append the rows not yet in the sheets
+
+    Args:
+        platform (str): Platform of all files; detected per file when None
+        processes (int): Pool size, one per CPU core by default
+        dry_run (bool): Transform and deduplicate only, write nothing
+
+    Returns:
+        dict: Stage -> rows that were (or would be) written
+    """
+    paths = find_exports(directory)
+    if not paths:
+        notify('info', f"No exports found in {directory}")
+        return {}
+
+    sheets = read_sheets(sh, ['옵션', '고객'], columns={'고객': CUSTOMER_KEY_COLUMNS})
+    option_df = sheets['옵션'].astype(str).apply(lambda x: x.str.strip())
+    customer_df = sheets['고객'].astype(str).apply(lambda x: x.str.strip())
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_pool,
+                             initargs=(option_df, customer_df)) as pool:
+        futures = {pool.submit(transform_file, path, platform): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            rows, events = future.result()
+            for level, message in events:
+                notify(level, f"{os.path.basename(path)}: {message}")
+            if rows is not None:
+                results[path] = rows
+
+    failed = [path for path in paths if path not in results]
+    if failed:
+        notify('warning', f"{len(failed)} files skipped: {', '.join(map(os.path.basename, failed))}")
+
+    if not results:
+        return {}
+    # Old orders and deliveries have been rolled over out of the live sheets
+    existing = {'customer': customer_df,
+                'order': read_unified('주문', sh, columns=TARGETS['order'][1]),
+                'delivery': read_unified('배송', sh, columns=TARGETS['delivery'][1])}
+    merged = merge_rows([results[path] for path in paths if path in results], existing)
+    notify('info', ', '.join(f"{TARGETS[stage][0]} {len(rows)}" for stage, rows in merged.items())
+                   + f" new rows from {len(results)} files")
+    if dry_run:
+        return merged
+
+    for stage, rows in merged.items():
+        if stage == 'customer':
+            # Customers may have been added by uploads since they were read
+            with sheet_lease(sh, '고객'):
+                current = read_columns('고객', sh, TARGETS['customer'][1])
+                rows = new_rows([rows], TARGETS['customer'][1], current)
+                write_rows(stage, rows, sh)
+        else:
+            write_rows(stage, rows, sh)
+    return merged
+
+
+if __name__ == '__main__':
+    from connections import open_spreadsheet
+    from tenants import DEFAULT_TENANT, set_tenant, tenant_config
+
+    parser = argparse.ArgumentParser(description="Reprocess a directory of platform exports")
+    parser.add_argument('directory', help="Directory of exported .xlsx/.xls files")
+    parser.add_argument('--platform', choices=list(PLATFORMS), help="Platform of all files, detected when omitted")
+    parser.add_argument('--processes', type=int, default=None, help="Pool processes, one per CPU core by default")
+    parser.add_argument('--tenant', default=DEFAULT_TENANT, help="Tenant whose spreadsheet is backfilled")
+    parser.add_argument('--dry-run', action='store_true', help="Report the new rows without writing them")
+    options = parser.parse_args()
+
+    set_tenant(options.tenant)
+    sh, _ = open_spreadsheet(tenant_config()['source'])
+    run_reported(ConsoleReporter(), backfill, options.directory, sh, options.platform,
+                 options.processes, options.dry_run)
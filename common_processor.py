@@ -1,8 +1,12 @@
-import streamlit as st
 import pandas as pd
 import re
 import io
-import msoffcrypto
+import threading
+from gspread.utils import ValueInputOption, rowcol_to_a1
+from progress import notify
+from history_store import record_history
+from journal import active_stage
+from leases import check_leases
 
 
 def load_the_spreadsheet(spreadsheetname, sh):
@@ -12,20 +16,171 @@ def load_the_spreadsheet(spreadsheetname, sh):
     df = pd.DataFrame(values[1:], columns=values[0])
     return df
 
-def update_worksheet(existing_df, data, sheet_name, success_msg, sh, spread):
-    """Common function to update worksheet with new data"""
+# Customer sheet columns needed to look up the 고객 key of an order
+CUSTOMER_KEY_COLUMNS = ['고객 휴대폰', '플랫폼', '고객 key']
+
+# (spreadsheet id, worksheet name) -> header row, resolved once per process
+_headers = {}
+_headers_lock = threading.Lock()
+
+def _sheet_range(sheet_name, cells):
+    return f"'{sheet_name}'!{cells}"
+
+def _header(sheet_name, sh, refresh=False):
+    key = (sh.id, sheet_name)
+    with _headers_lock:
+        if key in _headers and not refresh:
+            return _headers[key]
+    value_ranges = sh.values_batch_get([_sheet_range(sheet_name, '1:1')])['valueRanges']
+    header = (value_ranges[0].get('values') or [[]])[0]
+    with _headers_lock:
+        _headers[key] = header
+    return header
+
+def _column_letter(header, column):
+    return rowcol_to_a1(1, header.index(column) + 1)[:-1]
+
+def _typed(df, dtypes):
+    """Cast projected string columns: 'number' (commas allowed), 'datetime' or 'string'"""
+    for column, dtype in (dtypes or {}).items():
+        if dtype == 'number':
+            df[column] = pd.to_numeric(df[column].str.replace(',', '').str.strip(), errors='coerce')
+        elif dtype == 'datetime':
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+    return df
+
+def read_columns(sheet_name, sh, columns, dtypes=None):
+    """
+    Read only the given columns of a worksheet with a single batchGet
+
+    The header row is resolved once per process. Each column range starts at
+    the header cell, so a header that changed since it was resolved is
+    noticed and resolved again instead of returning the wrong column.
+
+    Args:
+        columns (list): Header names to read
+        dtypes (dict): Optional {column: 'number' | 'datetime' | 'string'}
+
+    Returns:
+        pandas.DataFrame: The columns in the given order, strings unless typed
+    """
+    for refresh in (False, True):
+        header = _header(sheet_name, sh, refresh=refresh)
+        missing = [column for column in columns if column not in header]
+        if missing:
+            continue
+        ranges = [_sheet_range(sheet_name, f'{letter}:{letter}')
+                  for letter in (_column_letter(header, column) for column in columns)]
+        value_ranges = sh.values_batch_get(ranges)['valueRanges']
+        cells = [[row[0] if row else '' for row in value_range.get('values', [])]
+                 for value_range in value_ranges]
+        if all(values and values[0] == column for values, column in zip(cells, columns)):
+            break
+    else:
+        raise KeyError(f"{sheet_name}: columns not found {missing or columns}")
+
+    # The API trims trailing empty cells, so columns can differ in length
+    length = max(len(values) for values in cells) - 1
+    df = pd.DataFrame({column: values[1:] + [''] * (length - len(values) + 1)
+                       for column, values in zip(columns, cells)})
+    return _typed(df, dtypes)
+
+def read_probe(sheet_name, sh, columns, rows, tail_rows):
+    """
+    Small sample of a worksheet for change detection, read with one batchGet
+
+    Returns:
+        list: [header row, values of the first of columns, then for each
+            column its values in the last tail_rows of the first rows rows]
+            with trailing empty cells removed
+    """
+    header = _header(sheet_name, sh)
+    letters = [_column_letter(header, column) for column in columns]
+    first = max(rows - tail_rows, 0) + 2
+    ranges = ([_sheet_range(sheet_name, '1:1'), _sheet_range(sheet_name, f'{letters[0]}:{letters[0]}')]
+              + [_sheet_range(sheet_name, f'{letter}{first}:{letter}{rows + 1}') for letter in letters])
+    value_ranges = sh.values_batch_get(ranges)['valueRanges']
+
+    def trimmed(values):
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    sampled = [value_range.get('values', []) for value_range in value_ranges]
+    return ([trimmed(list(sampled[0][0] if sampled[0] else []))]
+            + [trimmed([row[0] if row else '' for row in values]) for values in sampled[1:]])
+
+def contiguous_runs(positions):
+    """Group sorted row positions into (first, last) runs"""
+    runs = []
+    for position in positions:
+        if runs and position == runs[-1][1] + 1:
+            runs[-1][1] = position
+        else:
+            runs.append([position, position])
+    return runs
+
+def read_keyed_rows(sheet_name, sh, key_col, keys):
+    """
+    Read the rows whose key_col value is one of keys, without downloading the others
+
+    Only the key column is read in full. Rows appended by one upload are
+    adjacent, so the matching rows usually form a few blocks, fetched as
+    row ranges with one batchGet.
+    """
+    header = _header(sheet_name, sh)
+    sheet_keys = read_columns(sheet_name, sh, [key_col])[key_col]
+    positions = sheet_keys.isin(set(keys)).to_numpy().nonzero()[0]
+    if not len(positions):
+        return pd.DataFrame(columns=header)
+
+    # Sheet rows are 1-based and the header takes the first row
+    runs = contiguous_runs(positions)
+    value_ranges = sh.values_batch_get([_sheet_range(sheet_name, f'{first + 2}:{last + 2}')
+                                        for first, last in runs])['valueRanges']
+    rows = []
+    for (first, last), value_range in zip(runs, value_ranges):
+        values = value_range.get('values', [])
+        values += [[]] * (last - first + 1 - len(values))
+        rows += [row + [''] * (len(header) - len(row)) for row in values]
+    df = pd.DataFrame(rows, columns=header)
+    # Rows may have moved since the key column was read
+    return df[df[key_col].isin(set(keys))].reset_index(drop=True)
+
+def update_worksheet(data, sheet_name, success_msg, sh, history_kind=None):
+    """
+    Common function to append new rows to a worksheet
+    Rows are appended with the Sheets append API (INSERT_ROWS), which places
+    them after the last row at write time, so concurrent uploads to the same
+    worksheet never compute the same offset and overwrite each other.
+    Written rows are also snapshotted to the history store when history_kind is given.
+    Nothing is written once a lease held around the call was lost.
+    Inside a journaled stage the rows are journaled before the write and
+    the stage is marked committed after it.
+    Returns the rows that were written (empty if there was nothing to write)
+    """
+    journal_entry = active_stage()
+    if journal_entry is not None:
+        journal, stage = journal_entry
+        journal.record(stage, data, sheet_name, success_msg, history_kind)
+
     if not data.empty:
-        spread.df_to_sheet(
-            data,
-            sheet=sheet_name,
-            index=False,
-            headers=False, 
-            start=(len(existing_df)+2, 1),
-            replace=False
+        check_leases()
+        sh.worksheet(sheet_name).append_rows(
+            data.fillna('').astype(str).values.tolist(),
+            value_input_option=ValueInputOption.user_entered,
+            insert_data_option='INSERT_ROWS',
+            table_range='A1'
         )
-        st.sidebar.success(success_msg)
+        notify('success', success_msg)
+        if history_kind:
+            record_history(history_kind, data)
     else:
-        st.sidebar.info(f'No {sheet_name} data to update')
+        notify('info', f'No {sheet_name} data to update')
+
+    if journal_entry is not None:
+        journal.mark_committed(stage)
+    return data
 
     
 def get_delivery_date():
@@ -42,6 +197,18 @@ def get_delivery_date():
     else:
         return midnight.strftime('%Y-%m-%d')
 
+def get_delivery_dates(paid_at):
+    """
+    출고 날짜 of orders paid at the given times, with the same 6pm cutoff as get_delivery_date
+
+    Used when exports are reprocessed later, so historical deliveries keep
+    the date they shipped on instead of today's. Times that can not be
+    parsed fall back to get_delivery_date().
+    """
+    times = pd.to_datetime(paid_at, errors='coerce', format='mixed')
+    dates = times.dt.normalize() + pd.to_timedelta((times.dt.hour >= 18).astype(int), unit='D')
+    return dates.dt.strftime('%Y-%m-%d').fillna(get_delivery_date())
+
 
 
 def safe_convert(value):
@@ -94,6 +261,8 @@ def read_naver_excel(excel_file, password="1212", sheet_name="발주발송관리
     Returns:
         pandas.DataFrame: Decrypted Excel data as DataFrame
     """
+    import msoffcrypto  # Only Naver exports are encrypted
+
     decrypted_workbook = io.BytesIO()
     office_file = msoffcrypto.OfficeFile(excel_file)
     office_file.load_key(password=password)
@@ -0,0 +1,51 @@
+import ssl
+import streamlit as st
+from quota import request_slot, wait_for_quota
+
+# Shared by the app and worker processes
+ssl._create_default_https_context = ssl._create_unverified_context
+
+SCOPE = ['https://spreadsheets.google.com/feeds',
+         'https://www.googleapis.com/auth/drive']
+
+
+def _rate_limited(request):
+    """
+    Wrap Client.request so every API call waits for the account and current
+    tenant's quota, then holds a request slot while it is sent. Processors
+    reading and appending directly through gspread are bounded this way too.
+    """
+    def limited(*args, **kwargs):
+        wait_for_quota()
+        with request_slot():
+            return request(*args, **kwargs)
+    return limited
+
+@st.cache_resource
+def get_client():
+    """
+    Authorized gspread_pandas client, created on first use and shared by all
+    sessions and tenants, so they share one connection pool
+    """
+    from google.oauth2 import service_account
+    from gspread_pandas import Client
+
+    credentials = service_account.Credentials.from_service_account_info(
+                    st.secrets["gcp_service_account"], scopes=SCOPE)
+    client = Client(scope=SCOPE, creds=credentials)
+    client.request = _rate_limited(client.request)
+    return client
+
+@st.cache_resource
+def open_spreadsheet(name):
+    """
+    Open a spreadsheet once per process, whichever tenant it belongs to
+
+    Returns:
+        tuple: (gspread Spreadsheet, gspread_pandas Spread) of the same
+            spreadsheet; the Spreadsheet is the one the Spread already opened
+    """
+    from gspread_pandas import Spread
+
+    spread = Spread(name, client=get_client())
+    return spread.spread, spread
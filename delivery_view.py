@@ -1,15 +1,44 @@
-import streamlit as st
 import pandas as pd
-from gspread_pandas import Spread, Client
-from google.oauth2 import service_account
-from common_processor import update_worksheet, load_the_spreadsheet
+from connections import open_spreadsheet
+from tenants import tenant_config
+from common_processor import read_keyed_rows, read_columns
+from reference_cache import load_sheet
+from sheets_io import AsyncSheetsIO
+from progress import notify, preview
+from history_store import record_history
+from leases import sheet_lease
+from materialize import (load_state, save_state, frame_fingerprint, key_fingerprints,
+                         changed_keys, covering_keys, refresh_fingerprints, upsert_rows)
+import asyncio
 import re
 
-def get_latest_data(spread, sheet_name, date_col='기록 날짜'):
-    """Load data from sheet and filter for latest date"""
-    df = spread.sheet_to_df(sheet=sheet_name, index=None)
-    latest_date = df[date_col].max()
-    return df[df[date_col] == latest_date]
+# Source worksheets read in full by load_and_process_data; 배송 and 주문 are read by key
+REFERENCE_SOURCES = ['고객', '옵션 스큐 연결', '스큐']
+
+# Columns of the customer sheet the view uses
+CUSTOMER_COLUMNS = ['고객 key', '고객 이름', '고객 휴대폰', '플랫폼']
+
+def read_source(sheet_name, sh, keys=None):
+    """
+    Read a source worksheet with only the rows and columns the view uses
+
+    Args:
+        keys: 배송 keys to read from 배송, or 주문 keys to read from 주문
+    """
+    if sheet_name == '배송':
+        return read_keyed_rows(sheet_name, sh, '배송 key', keys)
+    if sheet_name == '주문':
+        return read_keyed_rows(sheet_name, sh, '주문 key', keys)
+    if sheet_name == '고객':
+        return load_sheet(sheet_name, sh, columns=CUSTOMER_COLUMNS)
+    return load_sheet(sheet_name, sh)
+
+def delivery_fingerprints(delivery_df, order_df):
+    """Fingerprint of each 배송 key over its delivery row and the order rows behind it"""
+    merged_df = pd.merge(delivery_df, order_df, on='주문 key', how='left', suffixes=('', '_order'))
+    # Record timestamps change on every upload without changing the delivery itself
+    merged_df = merged_df[[col for col in merged_df.columns if not col.startswith('기록')]]
+    return key_fingerprints(merged_df, '배송 key')
 
 def merge_and_group_delivery_data(delivery_df, order_df):
     """Merge delivery and order data and group by delivery fields"""
@@ -76,40 +105,122 @@ def get_sort_code(product_list):
             
     return ''.join(first_letters) if first_letters else ''
 
-def load_and_process_data():
-    # Set up Google Sheets connection
-    scope = ['https://spreadsheets.google.com/feeds',
-             'https://www.googleapis.com/auth/drive']
-    credentials = service_account.Credentials.from_service_account_info(
-                    st.secrets["gcp_service_account"], scopes = scope)
-    client = Client(scope=scope, creds=credentials)
-    
+def leased_upsert(dest_sh, dest_worksheet, final_delivery_df):
+    """
+    Upsert under the destination sheet's lease
+
+    The upsert rewrites rows by position, so the rows it positions against
+    are read inside the lease, after any other run's upsert has finished.
+    """
+    with sheet_lease(dest_sh, '배송'):
+        values = dest_worksheet.get_all_values()
+        existing_df = pd.DataFrame(values[1:], columns=values[0])
+        return upsert_rows(dest_worksheet, existing_df, final_delivery_df, '배송 key')
+
+def load_and_process_data(delivery_keys, prefetched=None):
+    """
+    Build the consolidated delivery view for the given deliveries
+
+    The refresh is driven by the 배송 keys a run committed rather than by
+    the sheet's latest rows, so runs committing concurrently each refresh
+    their own deliveries.
+
+    Args:
+        delivery_keys: 배송 keys to refresh
+        prefetched (dict): Optional {source sheet name: DataFrame} already read
+            by the caller (the 배송 and 주문 rows of the keys); only the missing
+            sheets and rows are downloaded
+
+    Returns:
+        pandas.DataFrame: Recomputed consolidated deliveries including the
+            '정렬' sort code, None when nothing changed
+
+    Raises:
+        Exception: The destination update failed; the refresh state is left
+            as it was, so the next refresh recomputes the same deliveries
+    """
     # Connect to spreadsheets
-    source_spread = Spread("원본 데이터", client=client)
-    source_sh = client.open("원본 데이터")
-    dest_spread = Spread("데이터 종합", client=client)
-    dest_sh = client.open("데이터 종합")
-
-    # Get latest data
-    latest_delivery_df = get_latest_data(source_spread, '배송')
-    latest_order_df = get_latest_data(source_spread, '주문')
-    
+    tenant = tenant_config()
+    source_sh, source_spread = open_spreadsheet(tenant['source'])
+    dest_sh, dest_spread = open_spreadsheet(tenant['dest'])
+
+    return asyncio.run(_build_delivery_view(AsyncSheetsIO(source_sh, source_spread),
+                                     AsyncSheetsIO(dest_sh, dest_spread),
+                                     set(delivery_keys), prefetched or {}))
+
+async def _completed(df):
+    return df
+
+async def _read_keyed(source_io, sheet_name, key_col, keys, prefetched):
+    """Rows of the keys, from the prefetched rows where present and downloaded otherwise"""
+    df = prefetched.get(sheet_name)
+    df = df[df[key_col].isin(keys)] if df is not None else pd.DataFrame(columns=[key_col])
+    missing = set(keys) - set(df[key_col])
+    if missing:
+        read = await source_io.call(read_source, sheet_name, source_io.sh, missing)
+        df = pd.concat([df, read], ignore_index=True) if not df.empty else read
+    return df.reset_index(drop=True)
+
+async def _build_delivery_view(source_io, dest_io, delivery_keys, prefetched):
+    """
+    Refresh the consolidated delivery rows in the destination sheet
+
+    The destination is maintained incrementally, keyed by 배송 key: only
+    the given deliveries whose source rows changed since the last refresh
+    are recomputed, then upserted so unchanged rows are left alone. All
+    source reads start at once; each transform waits only for the sheets
+    it needs, so the remaining downloads overlap with the CPU work.
+    """
+    reads = {name: asyncio.create_task(_completed(prefetched[name]) if name in prefetched
+                                       else source_io.call(read_source, name, source_io.sh))
+             for name in REFERENCE_SOURCES}
+
+    # Source rows of the deliveries and of the orders behind them
+    delivery_df = await _read_keyed(source_io, '배송', '배송 key', delivery_keys, prefetched)
+    order_df = await _read_keyed(source_io, '주문', '주문 key', set(delivery_df['주문 key']), prefetched)
+
+    # Only recompute deliveries whose source rows changed since the last refresh
+    state = load_state()
+    option_sku_df, sku_df = await reads['옵션 스큐 연결'], await reads['스큐']
+    reference = frame_fingerprint(option_sku_df, sku_df)
+    known = state['deliveries'] if state['reference'] == reference else {}
+    fingerprints = delivery_fingerprints(delivery_df, order_df)
+    changed = changed_keys(fingerprints, known)
+    if not changed:
+        notify('info', '변경된 배송 운영 데이터 없음 (4/4)')
+        return
+
+    # A consolidated row holding a changed delivery is rewritten whole, so every
+    # delivery in it is recomputed. The upsert re-checks this under the lease.
+    view_keys = await dest_io.call(read_columns, '배송', dest_io.sh, ['배송 key'])
+    changed = covering_keys(view_keys['배송 key'], changed)
+    if not changed <= set(delivery_df['배송 key']):
+        delivery_df = await _read_keyed(source_io, '배송', '배송 key', changed | set(delivery_df['배송 key']),
+                                        {'배송': delivery_df})
+        order_df = await _read_keyed(source_io, '주문', '주문 key', set(delivery_df['주문 key']),
+                                     {'주문': order_df})
+        fingerprints = delivery_fingerprints(delivery_df, order_df)
+
+    # Deliveries to the same address are consolidated together, so recompute whole addresses
+    addresses = delivery_df.loc[delivery_df['배송 key'].isin(changed), '배송 주소']
+    delivery_df = delivery_df[delivery_df['배송 주소'].isin(addresses)]
+    order_df = order_df[order_df['주문 key'].isin(delivery_df['주문 key'])]
+
     # Process delivery data
-    grouped_delivery_df = merge_and_group_delivery_data(latest_delivery_df, latest_order_df)
-    st.write("base_data DataFrame:", grouped_delivery_df)
+    grouped_delivery_df = await source_io.transform(merge_and_group_delivery_data,
+                                                    delivery_df, order_df)
+    preview("base_data DataFrame", grouped_delivery_df)
 
-    # Load and merge customer data
-    source_customer_df = source_spread.sheet_to_df(sheet='고객', index=None)
-    merged_customer_df = pd.merge(grouped_delivery_df, source_customer_df, 
+    # Merge customer data
+    merged_customer_df = pd.merge(grouped_delivery_df, await reads['고객'], 
                                 on='고객 key', how='left')
 
-    # Load and process SKU data
-    source_option_sku_df = source_spread.sheet_to_df(sheet='옵션 스큐 연결', index=None)
-    source_sku_df = source_spread.sheet_to_df(sheet='스큐', index=None)
-    merged_sku_df = process_sku_data(merged_customer_df, source_option_sku_df, source_sku_df)
+    # Process SKU data
+    merged_sku_df = await source_io.transform(process_sku_data, merged_customer_df,
+                                              option_sku_df, sku_df)
 
     # Group by address
-    grouped_by_address_df = group_by_address(merged_sku_df)
+    grouped_by_address_df = await source_io.transform(group_by_address, merged_sku_df)
 
     # Final grouping and column selection
     final_columns = [
@@ -124,22 +235,31 @@ def load_and_process_data():
         'SKU 수량': lambda x: '\n'.join([str(i) for i in x if pd.notna(i) and str(i).strip()])
     }).reset_index()
 
-    st.write("sku data DataFrame:", grouped_by_fields_df)
+    preview("sku data DataFrame", grouped_by_fields_df)
 
     # Prepare final delivery DataFrame
     final_columns = final_columns + ['SKU 이름', 'SKU 수량']
-    ordered_delivery_df = grouped_by_fields_df[final_columns]
+    ordered_delivery_df = grouped_by_fields_df[final_columns].copy()
     ordered_delivery_df['정렬'] = ordered_delivery_df['SKU 이름'].apply(get_sort_code)
-    final_delivery_df = ordered_delivery_df.fillna('').replace('nan', '')
-    # Reorder columns to match final_columns list and drop the 'sort' column that was temporarily used
-    final_delivery_df = final_delivery_df[final_columns]
+    consolidated_df = ordered_delivery_df.fillna('').replace('nan', '')
+    # The sheet does not store the sort code, only the exports use it
+    final_delivery_df = consolidated_df[final_columns]
 
-    st.write("result_df DataFrame:", final_delivery_df)
+    preview("result_df DataFrame", final_delivery_df)
 
     # Update destination spreadsheet
     try:
-        dest_delivery_df = load_the_spreadsheet('배송', dest_sh)
-        update_worksheet(dest_delivery_df, final_delivery_df, "배송", 
-                        "배송 운영 데이터 업데이트 완료 (4/4)", dest_sh, dest_spread)
+        dest_worksheet = await dest_io.call(dest_io.sh.worksheet, '배송')
+        counts = await dest_io.call(leased_upsert, dest_io.sh, dest_worksheet, final_delivery_df)
+        notify('success', f"배송 운영 데이터 업데이트 완료 (4/4) - 추가 {counts['appended']}, "
+                          f"수정 {counts['updated']}, 삭제 {counts['deleted']}, 유지 {counts['unchanged']}")
+
+        record_history('consolidated', final_delivery_df)
+
+        state['reference'] = reference
+        state['deliveries'] = refresh_fingerprints(known, fingerprints, delivery_df['배송 key'])
+        save_state(state)
+        return consolidated_df
     except Exception as e:
-        st.error(f"Error updating destination sheet: {str(e)}")
+        notify('error', f"Error updating destination sheet: {str(e)}")
+        raise
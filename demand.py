@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import pandas as pd
+from contextlib import closing
+from progress import notify
+from tenants import tenant_path
+
+DEMAND_DB = os.environ.get('DEMAND_DB', os.path.join('.cache', 'demand.db'))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sku_demand (
+    ship_date TEXT NOT NULL,
+    sku_key TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    sku_name TEXT,
+    units INTEGER NOT NULL,
+    PRIMARY KEY (ship_date, sku_key, platform)
+);
+CREATE TABLE IF NOT EXISTS demand_applied (
+    delivery_key TEXT PRIMARY KEY
+);
+"""
+
+
+def _connect(db_path):
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.executescript(_SCHEMA)
+    return conn
+
+def demand_rows(deliveries_df, orders_df, option_sku_df, sku_df):
+    """
+    SKU units per (출고 날짜, SKU key, 플랫폼) for a batch of deliveries
+
+    Units are 주문 수량 x SKU 수량, like process_sku_data computes them.
+    A delivery has one row per order line and the merge with the orders
+    brings the lines back, so each delivery of an order is taken once.
+    """
+    deliveries = deliveries_df[['배송 key', '주문 key', '출고 날짜']].drop_duplicates()
+    merged = deliveries.merge(
+        orders_df[['주문 key', '옵션 key', '주문 수량', '플랫폼']], on='주문 key')
+    merged = merged.merge(option_sku_df[['옵션 key', 'SKU key', 'SKU 수량']], on='옵션 key')
+    merged['units'] = (pd.to_numeric(merged['주문 수량'], errors='coerce').fillna(0)
+                       * pd.to_numeric(merged['SKU 수량'], errors='coerce').fillna(0)).astype(int)
+    names = sku_df.drop_duplicates('SKU key').set_index('SKU key')['SKU 이름']
+    merged['SKU 이름'] = merged['SKU key'].map(names).fillna('')
+    return merged.groupby(['출고 날짜', 'SKU key', '플랫폼'], as_index=False).agg(
+        {'SKU 이름': 'first', 'units': 'sum'})
+
+def update_demand(deliveries_df, orders_df, option_sku_df, sku_df, db_path=None):
+    """
+    Add newly committed deliveries to the SKU demand aggregate
+
+    Each 배송 key is counted once: deliveries already applied by an earlier
+    attempt of the same run are ignored, so retries and journal replays do
+    not double the totals.
+
+    Returns:
+        int: Number of deliveries applied
+    """
+    db_path = db_path or tenant_path(DEMAND_DB)
+    with closing(_connect(db_path)) as conn, conn:
+        keys = deliveries_df['배송 key'].astype(str).unique().tolist()
+        applied = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            applied.update(row[0] for row in conn.execute(
+                f"SELECT delivery_key FROM demand_applied WHERE delivery_key IN ({','.join('?' * len(chunk))})",
+                chunk))
+        new_deliveries = deliveries_df[~deliveries_df['배송 key'].astype(str).isin(applied)]
+        if new_deliveries.empty:
+            return 0
+        delivery_count = new_deliveries['배송 key'].nunique()
+
+        rows = demand_rows(new_deliveries, orders_df, option_sku_df, sku_df)
+        conn.executemany(
+            "INSERT INTO sku_demand (ship_date, sku_key, platform, sku_name, units) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (ship_date, sku_key, platform) DO UPDATE SET "
+            "units = units + excluded.units, sku_name = excluded.sku_name",
+            rows[['출고 날짜', 'SKU key', '플랫폼', 'SKU 이름', 'units']].astype(object).values.tolist())
+        conn.executemany("INSERT INTO demand_applied (delivery_key) VALUES (?)",
+                         [(key,) for key in new_deliveries['배송 key'].astype(str).unique()])
+
+    notify('success', f"SKU 출고 수량 집계 업데이트 완료 - {delivery_count} 건")
+    return delivery_count
+
+def get_demand(ship_date, sku_key=None, platform=None, db_path=None):
+    """
+    SKU units shipping on a 출고 날짜, read from the aggregate by primary key
+
+    Returns:
+        pandas.DataFrame: 출고 날짜, SKU key, 플랫폼, SKU 이름, 수량
+    """
+    db_path = db_path or tenant_path(DEMAND_DB)
+    query = "SELECT ship_date, sku_key, platform, sku_name, units FROM sku_demand WHERE ship_date = ?"
+    params = [ship_date]
+    if sku_key is not None:
+        query += " AND sku_key = ?"
+        params.append(sku_key)
+    if platform is not None:
+        query += " AND platform = ?"
+        params.append(platform)
+    with closing(_connect(db_path)) as conn:
+        rows = conn.execute(query + " ORDER BY sku_key, platform", params).fetchall()
+    return pd.DataFrame(rows, columns=['출고 날짜', 'SKU key', '플랫폼', 'SKU 이름', '수량'])
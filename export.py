@@ -0,0 +1,119 @@
+import os
+import csv
+import uuid
+import pandas as pd
+from progress import notify
+from tenants import tenant_path
+
+EXPORT_DIR = 'exports'
+
+# 'xlsx' or 'csv'
+EXPORT_FORMAT = os.environ.get('EXPORT_FORMAT', 'xlsx')
+
+# Courier upload column -> consolidated delivery column
+COURIER_COLUMNS = {
+    '고객주문번호': '배송 key',
+    '받는분성명': '수취자 이름',
+    '받는분전화번호': '수취자 휴대폰',
+    '받는분기타연락처': '수취자 전화번호',
+    '받는분주소(전체, 분할)': '배송 주소',
+    '품목명': None,
+    '내품수량': None,
+    '배송메세지1': '배송 메시지',
+    '선착불': '선착불 여부',
+}
+
+PICKING_COLUMNS = ['정렬', '배송 key', '수취자 이름', '배송 주소', 'SKU 이름', 'SKU 수량']
+
+
+def _sku_lines(row):
+    """(SKU 이름, SKU 수량) pairs of a consolidated row, one per line"""
+    names = str(row['SKU 이름']).split('\n') if row['SKU 이름'] else []
+    quantities = str(row['SKU 수량']).split('\n') if row['SKU 수량'] else []
+    return list(zip(names, quantities + [''] * (len(names) - len(quantities))))
+
+def _quantity(value):
+    try:
+        return int(float(value))
+    except ValueError:
+        return 0
+
+def courier_rows(df):
+    """Rows of the courier upload file, one per consolidated shipment"""
+    for _, row in df.iterrows():
+        lines = _sku_lines(row)
+        values = []
+        for column, source in COURIER_COLUMNS.items():
+            if column == '품목명':
+                values.append(', '.join(f'{name} x{quantity}' if quantity else name for name, quantity in lines))
+            elif column == '내품수량':
+                values.append(sum(_quantity(quantity) for _, quantity in lines))
+            else:
+                values.append(row.get(source, ''))
+        yield values
+
+def picking_rows(df):
+    """Rows of the picking list: one per SKU line, shipments ordered by their sort code"""
+    ordered = df.sort_values(['정렬', '배송 주소', '배송 key'], kind='stable')
+    for _, row in ordered.iterrows():
+        for name, quantity in _sku_lines(row):
+            yield [row['정렬'], row['배송 key'], row['수취자 이름'], row['배송 주소'], name, quantity]
+
+def write_rows(path, header, rows):
+    """
+    Stream rows into a .csv or .xlsx file without holding the file in memory
+
+    CSV is written with a BOM so Excel opens Korean text correctly; xlsx uses
+    openpyxl's write-only mode, which flushes rows as they are appended.
+    """
+    if path.endswith('.csv'):
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        return path
+
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    worksheet.append(header)
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(path)
+    return path
+
+def export_deliveries(consolidated_df, export_format=EXPORT_FORMAT, export_dir=None):
+    """
+    Write the courier upload file and picking list for consolidated deliveries
+
+    Args:
+        consolidated_df (pandas.DataFrame): Output of load_and_process_data,
+            including the '정렬' sort code
+        export_format (str): 'xlsx' or 'csv'
+
+    Returns:
+        dict: {'courier': path, 'picking': path}
+    """
+    export_dir = export_dir or tenant_path(EXPORT_DIR)
+    now = pd.Timestamp.now()
+    day_dir = os.path.join(export_dir, f'{now:%Y-%m-%d}')
+    os.makedirs(day_dir, exist_ok=True)
+    suffix = f'{now:%H%M%S}-{uuid.uuid4().hex[:6]}.{export_format}'
+
+    paths = {
+        'courier': write_rows(os.path.join(day_dir, f'courier-{suffix}'),
+                              list(COURIER_COLUMNS), courier_rows(consolidated_df)),
+        'picking': write_rows(os.path.join(day_dir, f'picking-{suffix}'),
+                              PICKING_COLUMNS, picking_rows(consolidated_df)),
+    }
+    notify('success', f"택배 업로드 파일 및 피킹 리스트 생성 완료 - {len(consolidated_df)} 건")
+    return paths
+
+def list_exports(export_dir=None, limit=6):
+    """Most recent export files, newest first"""
+    export_dir = export_dir or tenant_path(EXPORT_DIR)
+    if not os.path.isdir(export_dir):
+        return []
+    paths = [os.path.join(root, name) for root, _, names in os.walk(export_dir) for name in names]
+    return sorted(paths, key=os.path.getmtime, reverse=True)[:limit]
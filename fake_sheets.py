@@ -0,0 +1,146 @@
+import time
+import threading
+import pandas as pd
+from gspread.utils import a1_to_rowcol, a1_range_to_grid_range
+from gspread.exceptions import WorksheetNotFound
+
+
+class FakeWorksheet:
+    """In-memory stand-in for a gspread worksheet"""
+
+    def __init__(self, workbook, title, values, id=0):
+        self.workbook = workbook
+        self.spreadsheet = workbook
+        self.title = title
+        self.values = values
+        self.id = id
+
+    def _touch(self):
+        self.workbook.modified_count += 1
+
+    def get_all_values(self):
+        self.workbook._simulate_request()
+        with self.workbook.lock:
+            return [list(row) for row in self.values]
+
+    def batch_update(self, data, value_input_option=None):
+        """Write single-row ranges like 'A5:Q5'"""
+        self.workbook._simulate_request()
+        with self.workbook.lock:
+            for update in data:
+                row, col = a1_to_rowcol(update['range'].split(':')[0])
+                for offset, values in enumerate(update['values']):
+                    self.values[row - 1 + offset][col - 1:col - 1 + len(values)] = list(values)
+            self._touch()
+
+    def delete_rows(self, start_index, end_index=None):
+        self.workbook._simulate_request()
+        with self.workbook.lock:
+            del self.values[start_index - 1:(end_index or start_index)]
+            self._touch()
+
+    def append_rows(self, values, value_input_option=None, insert_data_option=None, table_range=None):
+        self.workbook._simulate_request()
+        with self.workbook.lock:
+            self.values.extend(list(row) for row in values)
+            self._touch()
+
+
+class FakeWorkbook:
+    """
+    Local stand-in for the gspread Spreadsheet (`sh`) and gspread_pandas
+    Spread (`spread`) objects used by the processors
+
+    Each request sleeps for `latency` seconds so overlap between reads,
+    writes and transforms can be observed without touching Google Sheets.
+    Use the same object for both the `sh` and `spread` arguments.
+
+    Args:
+        sheets (dict): {worksheet name: list of rows, header row first}
+        latency (float): Simulated round trip per request in seconds
+    """
+
+    def __init__(self, sheets, latency=0.0, id='fake'):
+        self.id = id
+        self.client = self
+        self.modified_count = 0
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self._worksheets = {title: FakeWorksheet(self, title, [list(row) for row in rows], id=sheet_id)
+                            for sheet_id, (title, rows) in enumerate(sheets.items())}
+
+    def _simulate_request(self):
+        with self.lock:
+            self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_file_drive_metadata(self, id):
+        self._simulate_request()
+        return {'id': id, 'modifiedTime': f'modified-{self.modified_count}'}
+
+    def values_batch_get(self, ranges, params=None):
+        """A1 ranges like "'옵션'!B:B" or "'주문'!5:9", trimmed like the values API"""
+        self._simulate_request()
+        value_ranges = []
+        with self.lock:
+            for range_name in ranges:
+                title, cells = range_name.rsplit('!', 1)
+                grid = a1_range_to_grid_range(cells)
+                rows = self._worksheets[title.strip("'")].values
+                values = []
+                for row in rows[grid.get('startRowIndex', 0):grid.get('endRowIndex', len(rows))]:
+                    row = list(row[grid.get('startColumnIndex', 0):grid.get('endColumnIndex', len(row))])
+                    while row and row[-1] == '':
+                        row.pop()
+                    values.append(row)
+                while values and not values[-1]:
+                    values.pop()
+                value_ranges.append({'range': range_name, 'values': values})
+        return {'valueRanges': value_ranges}
+
+    def worksheet(self, title):
+        if title not in self._worksheets:
+            raise WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def batch_update(self, body):
+        """Structural updates; only row deleteDimension requests are supported"""
+        self._simulate_request()
+        worksheets = {worksheet.id: worksheet for worksheet in self._worksheets.values()}
+        with self.lock:
+            for request in body['requests']:
+                grid = request['deleteDimension']['range']
+                if grid['dimension'] != 'ROWS':
+                    raise NotImplementedError(grid['dimension'])
+                del worksheets[grid['sheetId']].values[grid['startIndex']:grid['endIndex']]
+            self.modified_count += 1
+        return {'replies': [{} for _ in body['requests']]}
+
+    def add_worksheet(self, title, rows=1, cols=1):
+        self._simulate_request()
+        with self.lock:
+            self._worksheets[title] = FakeWorksheet(self, title, [], id=len(self._worksheets))
+            self.modified_count += 1
+        return self._worksheets[title]
+
+    def worksheets(self):
+        return list(self._worksheets.values())
+
+    def sheet_to_df(self, sheet, index=None):
+        values = self.worksheet(sheet).get_all_values()
+        return pd.DataFrame(values[1:], columns=values[0])
+
+    def df_to_sheet(self, df, sheet, index=False, headers=False, start=(1, 1), replace=False):
+        """Write `df` at the 1-based (row, col) `start` offset, like gspread_pandas"""
+        self._simulate_request()
+        rows = df.fillna('').astype(str).values.tolist()
+        with self.lock:
+            values = self._worksheets[sheet].values
+            first_row = start[0] - 1
+            while len(values) < first_row + len(rows):
+                values.append([])
+            for offset, row in enumerate(rows):
+                values[first_row + offset] = row
+            self.modified_count += 1
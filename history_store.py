@@ -0,0 +1,138 @@
+import os
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from progress import notify
+from tenants import tenant_path
+
+HISTORY_DIR = 'history'
+
+_STRING = pa.string()
+_AMOUNT = pa.float64()
+_COUNT = pa.int64()
+_TIMESTAMP = pa.timestamp('s')
+_DATE = pa.date32()
+
+# Stable typed schema of every history table; columns missing from a frame are stored as null
+SCHEMAS = {
+    'customer': pa.schema([
+        ('고객 key', _STRING), ('고객 id', _STRING), ('고객 이름', _STRING),
+        ('고객 휴대폰', _STRING), ('고객 전화번호', _STRING), ('플랫폼', _STRING),
+        ('기록 날짜', _TIMESTAMP),
+    ]),
+    'order': pa.schema([
+        ('주문 key', _STRING), ('옵션 key', _STRING), ('고객 key', _STRING), ('주문 id', _STRING),
+        ('주문 날짜', _STRING), ('결제 날짜', _STRING),
+        ('판매금액', _AMOUNT), ('할인금액', _AMOUNT), ('플랫폼 비용', _AMOUNT), ('정산금액', _AMOUNT),
+        ('배송비', _AMOUNT), ('주문 수량', _COUNT),
+        ('사은품', _STRING), ('주문 총 무게', _STRING), ('주문 상태', _STRING), ('플랫폼', _STRING),
+        ('기록 날짜', _TIMESTAMP),
+    ]),
+    'delivery': pa.schema([
+        ('배송 key', _STRING), ('주문 key', _STRING), ('배송 주소', _STRING), ('배송 우편번호', _STRING),
+        ('배송 메시지', _STRING), ('출고 날짜', _DATE), ('해당 배송회차', _STRING),
+        ('방문수령 여부', _STRING), ('방문수령 날짜', _STRING), ('수취자 휴대폰', _STRING),
+        ('수취자 전화번호', _STRING), ('수취자 이름', _STRING), ('선착불 여부', _STRING),
+        ('선착불 금액', _STRING), ('기록 날짜', _TIMESTAMP),
+    ]),
+    'consolidated': pa.schema([
+        ('배송 key', _STRING), ('주문 key', _STRING), ('고객 key', _STRING), ('수취자 이름', _STRING),
+        ('고객 이름', _STRING), ('배송 주소', _STRING), ('수취자 휴대폰', _STRING),
+        ('수취자 전화번호', _STRING), ('고객 휴대폰', _STRING), ('선착불 여부', _STRING),
+        ('배송 메시지', _STRING), ('주문 id', _STRING), ('플랫폼', _STRING), ('출고 날짜', _DATE),
+        ('해당 배송 회차', _STRING), ('SKU 이름', _STRING), ('SKU 수량', _STRING),
+        ('기록 날짜', _TIMESTAMP),
+    ]),
+}
+
+
+def _to_number(values):
+    """Parse '1,000'-style strings, unparseable values become null"""
+    return pd.to_numeric(values.astype(str).str.replace(',', '').str.strip(), errors='coerce')
+
+def _typed_frame(df, schema, recorded_at):
+    """Cast a frame to the schema's column order and types"""
+    # Processors write the 기록 날짜 column without the space
+    df = df.rename(columns={'기록날짜': '기록 날짜'})
+    typed = {}
+    for field in schema:
+        values = df[field.name] if field.name in df else pd.Series([None] * len(df), index=df.index)
+        if field.name == '기록 날짜':
+            values = pd.to_datetime(values, errors='coerce').fillna(recorded_at)
+            typed[field.name] = values.dt.floor('s')
+        elif field.type == _AMOUNT:
+            typed[field.name] = _to_number(values).astype('float64')
+        elif field.type == _COUNT:
+            typed[field.name] = _to_number(values).round().astype('Int64')
+        elif field.type == _DATE:
+            typed[field.name] = pd.to_datetime(values, errors='coerce').dt.date
+        else:
+            typed[field.name] = values.map(lambda v: None if pd.isna(v) else str(v))
+    return pd.DataFrame(typed)
+
+def append_history(kind, df, history_dir=None):
+    """
+    Append one run's rows of a table as a Parquet file in today's partition
+
+    Files are laid out as <history_dir>/<kind>/run_date=YYYY-MM-DD/part-*.parquet
+    so readers can prune partitions by date.
+
+    Returns:
+        str: Path of the written file, None when there was nothing to write
+    """
+    history_dir = history_dir or tenant_path(HISTORY_DIR)
+    if df is None or df.empty:
+        return None
+    recorded_at = pd.Timestamp.now().floor('s')
+    table = pa.Table.from_pandas(_typed_frame(df, SCHEMAS[kind], recorded_at),
+                                 schema=SCHEMAS[kind], preserve_index=False)
+
+    partition_dir = os.path.join(history_dir, kind, f'run_date={recorded_at:%Y-%m-%d}')
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, f'part-{recorded_at:%H%M%S}-{uuid.uuid4().hex[:8]}.parquet')
+    pq.write_table(table, path, compression='zstd')
+    return path
+
+def record_history(kind, df):
+    """append_history for the pipeline: a failed snapshot must not fail the run"""
+    try:
+        append_history(kind, df)
+    except Exception as e:
+        notify('warning', f"Could not save {kind} history: {str(e)}")
+
+def read_history(kind, columns=None, start_date=None, end_date=None, filter=None,
+                 history_dir=None):
+    """
+    Read a history table with column projection and predicate pushdown
+
+    Args:
+        kind (str): 'customer', 'order', 'delivery' or 'consolidated'
+        columns (list): Columns to read, all by default
+        start_date, end_date (str): Inclusive 'YYYY-MM-DD' run date bounds,
+            applied to the partition directories
+        filter (pyarrow.dataset.Expression): Extra row filter, e.g.
+            ds.field('플랫폼') == '쿠팡'
+
+    Returns:
+        pandas.DataFrame
+    """
+    history_dir = history_dir or tenant_path(HISTORY_DIR)
+    import pyarrow.dataset as ds  # Only needed for reading
+
+    root = os.path.join(history_dir, kind)
+    schema = SCHEMAS[kind]
+    if not os.path.isdir(root):
+        return schema.empty_table().to_pandas()[columns or schema.names]
+
+    dataset = ds.dataset(root, format='parquet', schema=schema.append(pa.field('run_date', _STRING)),
+                         partitioning='hive')
+    conditions = [] if filter is None else [filter]
+    if start_date is not None:
+        conditions.append(ds.field('run_date') >= start_date)
+    if end_date is not None:
+        conditions.append(ds.field('run_date') <= end_date)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return dataset.to_table(columns=columns or schema.names, filter=expression).to_pandas()
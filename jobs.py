@@ -0,0 +1,215 @@
+import os
+import json
+import pickle
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from progress import RunReporter
+
+JOBS_DB = os.environ.get('JOBS_DB', os.path.join('.jobs', 'jobs.db'))
+
+# A running job whose worker has not sent a heartbeat for this long is queued again
+STALE_AFTER_SECONDS = 120
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    payload BLOB,
+    verbose INTEGER NOT NULL DEFAULT 0,
+    run_id TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    heartbeat_at TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id INTEGER NOT NULL,
+    at TEXT NOT NULL,
+    level TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_stages (
+    job_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (job_id, name)
+);
+CREATE TABLE IF NOT EXISTS job_previews (
+    job_id INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    frame BLOB NOT NULL
+);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+@contextmanager
+def connect(db_path=JOBS_DB):
+    """Short-lived connection in its own transaction; safe to use from any thread or process"""
+    with _init_lock:
+        if db_path not in _initialized:
+            os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+            with sqlite3.connect(db_path) as conn:
+                # WAL lets the page read job status while workers write
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(_SCHEMA)
+            _initialized.add(db_path)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def enqueue(kind, args, payload=None, verbose=False, db_path=JOBS_DB):
+    """
+    Queue a job for the workers
+
+    Args:
+        kind (str): Handler name, e.g. 'upload'
+        args (dict): JSON-serializable handler arguments
+        payload (bytes): Uploaded file contents, if any
+
+    Returns:
+        int: Job id
+    """
+    with connect(db_path) as conn:
+        cursor = conn.execute(
+            'INSERT INTO jobs (kind, args, payload, verbose, created_at) VALUES (?, ?, ?, ?, ?)',
+            (kind, json.dumps(args, ensure_ascii=False), payload, int(verbose), _now()))
+        return cursor.lastrowid
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+def claim_next(worker, db_path=JOBS_DB):
+    """Atomically take the oldest queued job, or return None"""
+    with connect(db_path) as conn:
+        # Take the write lock before reading so two workers never claim the same job
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE jobs SET status = 'running', worker = ?, started_at = ?, heartbeat_at = ? "
+                     "WHERE id = ?", (worker, _now(), _now(), row['id']))
+        return dict(row)
+
+def heartbeat(job_id, db_path=JOBS_DB):
+    with connect(db_path) as conn:
+        conn.execute('UPDATE jobs SET heartbeat_at = ? WHERE id = ?', (_now(), job_id))
+
+def finish_job(job_id, error=None, db_path=JOBS_DB):
+    """Mark a job done, or failed with the error message; its payload is no longer needed"""
+    with connect(db_path) as conn:
+        conn.execute('UPDATE jobs SET status = ?, finished_at = ?, error = ?, payload = NULL WHERE id = ?',
+                     ('failed' if error else 'done', _now(), error, job_id))
+
+def set_run_id(job_id, run_id, db_path=JOBS_DB):
+    """Link a job to the journal of its upload run, so a retry resumes it"""
+    with connect(db_path) as conn:
+        conn.execute('UPDATE jobs SET run_id = ? WHERE id = ?', (run_id, job_id))
+
+def requeue_stale(stale_after=STALE_AFTER_SECONDS, db_path=JOBS_DB):
+    """
+    Queue running jobs of workers that stopped sending heartbeats again
+
+    Upload runs are journaled, so the retried job resumes after the stages
+    that had already committed.
+
+    Returns:
+        int: Number of jobs queued again
+    """
+    with connect(db_path) as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL "
+            "WHERE status = 'running' AND heartbeat_at < datetime('now', 'localtime', ?)",
+            (f'-{int(stale_after)} seconds',))
+        return cursor.rowcount
+
+def list_jobs(limit=20, db_path=JOBS_DB):
+    """Most recent jobs without their payload, newest first"""
+    with connect(db_path) as conn:
+        rows = conn.execute('SELECT id, kind, args, run_id, status, worker, created_at, started_at, finished_at, '
+                            'error FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+def active_run_ids(db_path=JOBS_DB):
+    """Journal run ids that a queued or running job is working on"""
+    with connect(db_path) as conn:
+        rows = conn.execute("SELECT run_id FROM jobs WHERE status IN ('queued', 'running') "
+                            "AND run_id IS NOT NULL").fetchall()
+    return {row['run_id'] for row in rows}
+
+
+class JobReporter(RunReporter):
+    """RunReporter of a worker that also persists progress so any page can poll it"""
+
+    def __init__(self, job_id, verbose=False, db_path=JOBS_DB):
+        super().__init__(verbose=verbose)
+        self.job_id = job_id
+        self.db_path = db_path
+
+    def add_event(self, level, message):
+        super().add_event(level, message)
+        with connect(self.db_path) as conn:
+            conn.execute('INSERT INTO job_events (job_id, at, level, message) VALUES (?, ?, ?, ?)',
+                         (self.job_id, _now(), level, message))
+
+    def add_preview(self, label, df):
+        super().add_preview(label, df)
+        with connect(self.db_path) as conn:
+            conn.execute('INSERT INTO job_previews (job_id, label, frame) VALUES (?, ?, ?)',
+                         (self.job_id, label, pickle.dumps(df)))
+
+    def set_stage(self, name, status):
+        super().set_stage(name, status)
+        with connect(self.db_path) as conn:
+            conn.execute('INSERT INTO job_stages (job_id, name, status) VALUES (?, ?, ?) '
+                         'ON CONFLICT (job_id, name) DO UPDATE SET status = excluded.status',
+                         (self.job_id, name, status))
+
+
+class JobSnapshot(RunReporter):
+    """Progress of a queued job as last persisted, renderable like a RunReporter"""
+
+    def __init__(self, job):
+        super().__init__(verbose=bool(job['verbose']))
+        self.job = job
+
+    @property
+    def running(self):
+        return self.job['status'] in ('queued', 'running')
+
+def load_job(job_id, with_previews=False, db_path=JOBS_DB):
+    """Snapshot of a job's status, events and stages (and previews when asked)"""
+    with connect(db_path) as conn:
+        job = conn.execute('SELECT id, kind, args, verbose, run_id, status, worker, created_at, started_at, '
+                           'finished_at, error FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if job is None:
+            return None
+        snapshot = JobSnapshot(dict(job))
+        snapshot.events = [(datetime.strptime(row['at'], '%Y-%m-%d %H:%M:%S'), row['level'], row['message'])
+                           for row in conn.execute('SELECT * FROM job_events WHERE job_id = ? ORDER BY rowid',
+                                                   (job_id,))]
+        snapshot.stages = {row['name']: row['status']
+                           for row in conn.execute('SELECT * FROM job_stages WHERE job_id = ? ORDER BY rowid',
+                                                   (job_id,))}
+        if with_previews:
+            snapshot.previews = [(row['label'], pickle.loads(row['frame']))
+                                 for row in conn.execute('SELECT * FROM job_previews WHERE job_id = ? '
+                                                         'ORDER BY rowid', (job_id,))]
+    return snapshot
@@ -0,0 +1,141 @@
+import os
+import json
+import uuid
+import shutil
+import threading
+import contextvars
+import pandas as pd
+from contextlib import contextmanager
+from tenants import tenant_path
+
+JOURNAL_DIR = '.journal'
+
+# (journal, stage name) of the stage executing in the current context
+_active_stage = contextvars.ContextVar('active_journal_stage', default=None)
+
+
+class Journal:
+    """
+    Write-ahead journal of one upload run
+
+    The parsed upload and every stage's computed rows are saved locally
+    before they are written to the sheet ('computed'), and the stage is
+    marked 'committed' once the write succeeded. A failed or interrupted
+    run can then resume without reading the Excel file again: committed
+    stages are skipped and computed rows are written without recomputing.
+
+    Layout: <JOURNAL_DIR>/<run id>/manifest.json, input.pkl, <stage>.pkl
+    """
+
+    def __init__(self, run_id, journal_dir=None):
+        journal_dir = journal_dir or tenant_path(JOURNAL_DIR)
+        self.run_id = run_id
+        self.path = os.path.join(journal_dir, run_id)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, platform, file_name, df, journal_dir=None):
+        """Start a journal for a new run and save its parsed upload"""
+        run_id = f"{pd.Timestamp.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        journal = cls(run_id, journal_dir)
+        os.makedirs(journal.path)
+        journal._write_frame('input', df)
+        journal._write_manifest({
+            'run_id': run_id,
+            'platform': platform,
+            'file_name': file_name,
+            'created_at': f"{pd.Timestamp.now():%Y-%m-%d %H:%M:%S}",
+            'stages': {}
+        })
+        return journal
+
+    @property
+    def manifest(self):
+        with open(os.path.join(self.path, 'manifest.json'), encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        tmp_path = os.path.join(self.path, 'manifest.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, 'manifest.json'))
+
+    def _write_frame(self, name, df):
+        tmp_path = os.path.join(self.path, f'{name}.pkl.tmp')
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, os.path.join(self.path, f'{name}.pkl'))
+
+    def load_input(self):
+        """Parsed upload saved when the run started"""
+        return pd.read_pickle(os.path.join(self.path, 'input.pkl'))
+
+    def status(self, stage):
+        """'computed', 'committed' or None if the stage has not produced output yet"""
+        return self.manifest['stages'].get(stage, {}).get('status')
+
+    def entry(self, stage):
+        return self.manifest['stages'][stage]
+
+    def output(self, stage):
+        """Rows computed by a stage"""
+        return pd.read_pickle(os.path.join(self.path, f'{stage}.pkl'))
+
+    def record(self, stage, data, sheet_name, success_msg, history_kind):
+        """Save a stage's rows before they are written to the sheet"""
+        with self.lock:
+            self._write_frame(stage, data)
+            manifest = self.manifest
+            manifest['stages'][stage] = {
+                'status': 'computed',
+                'sheet': sheet_name,
+                'success_msg': success_msg,
+                'history_kind': history_kind,
+                'rows': len(data)
+            }
+            self._write_manifest(manifest)
+
+    def mark_committed(self, stage):
+        with self.lock:
+            manifest = self.manifest
+            manifest['stages'][stage]['status'] = 'committed'
+            self._write_manifest(manifest)
+
+    def record_committed(self, stage, data):
+        """Save the rows of a stage that wrote them itself, e.g. the delivery view"""
+        with self.lock:
+            self._write_frame(stage, data)
+            manifest = self.manifest
+            manifest['stages'][stage] = {'status': 'committed', 'rows': len(data)}
+            self._write_manifest(manifest)
+
+    def discard(self):
+        """Remove the journal once the run completed"""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+@contextmanager
+def journal_stage(journal, stage):
+    """Journal the worksheet writes made while running a stage"""
+    token = _active_stage.set((journal, stage))
+    try:
+        yield
+    finally:
+        _active_stage.reset(token)
+
+def active_stage():
+    """(journal, stage name) of the running stage, or None"""
+    return _active_stage.get()
+
+def list_unfinished(journal_dir=None):
+    """Manifests of runs that did not complete, oldest first"""
+    journal_dir = journal_dir or tenant_path(JOURNAL_DIR)
+    if not os.path.isdir(journal_dir):
+        return []
+    manifests = []
+    for run_id in sorted(os.listdir(journal_dir)):
+        try:
+            manifests.append(Journal(run_id, journal_dir).manifest)
+        except (OSError, ValueError):
+            # Interrupted before its manifest was written
+            continue
+    return manifests
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+
+class KeyIndex:
+    """
+    Hash index from a key to a value, built once and probed with whole columns
+
+    Probing goes through the hash table of a pandas Index, so mapping n rows
+    costs O(n) whatever the size of the index. Results are aligned to the
+    index of the probing Series, so they can be assigned next to the probed
+    frame's columns without depending on row order. When a key occurs more
+    than once the first row wins.
+    """
+
+    def __init__(self, keys, values):
+        keys = pd.Index(keys)
+        first = ~keys.duplicated(keep='first')
+        self.keys = keys[first]
+        # The trailing NaN is picked by the -1 position of missing keys
+        self.values = np.append(np.asarray(values, dtype=object)[first], np.nan)
+
+    @classmethod
+    def from_frame(cls, frame, key_column, value_column):
+        return cls(frame[key_column].values, frame[value_column].values)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, keys):
+        """
+        Values for a Series of keys
+
+        Returns:
+            pandas.Series: Values aligned to keys.index, NaN where a key is not indexed
+        """
+        positions = self.keys.get_indexer(keys.values)
+        return pd.Series(self.values[positions], index=keys.index, dtype=object)
+
+
+def build_customer_index(customer_df, platform):
+    """고객 휴대폰 -> 고객 key of one platform's customers"""
+    customers = customer_df[customer_df['플랫폼'] == platform]
+    return KeyIndex.from_frame(customers, '고객 휴대폰', '고객 key')
+
+def lookup_customer_keys(customer_index, phones):
+    """고객 key of each order row, aligned to phones.index"""
+    return customer_index.lookup(phones.fillna('').astype(str))
@@ -0,0 +1,112 @@
+import time
+import uuid
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+from jobs import JOBS_DB, connect, worker_name
+
+# A lease not renewed for this long is considered abandoned and can be taken over
+LEASE_SECONDS = 60
+WAIT_INTERVAL = 0.2
+# Delay before retrying a renewal that failed, e.g. on a locked database
+RENEW_RETRY_SECONDS = 1
+
+# (name, lost event) of the leases held in the current context
+_held_leases = contextvars.ContextVar('held_leases', default=())
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+)
+"""
+
+
+class LeaseLost(RuntimeError):
+    """A held lease expired or was taken over, so the holder must not write"""
+
+
+def _acquire(conn, name, holder, ttl):
+    """Take the lease when it is free or expired; True on success"""
+    conn.execute(_SCHEMA)
+    now = time.time()
+    cursor = conn.execute(
+        'INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) '
+        'ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at '
+        'WHERE leases.expires_at < ? OR leases.holder = excluded.holder',
+        (name, holder, now + ttl, now))
+    return cursor.rowcount == 1
+
+def _release(conn, name, holder):
+    conn.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+
+@contextmanager
+def lease(name, ttl=LEASE_SECONDS, timeout=None, db_path=JOBS_DB):
+    """
+    Hold an exclusive lease on a named resource across threads and worker processes
+
+    The lease is renewed in the background while held, and expires by itself
+    if its holder dies, so a crashed worker cannot block others for longer
+    than ttl seconds. Failed renewals are retried; when the lease is lost
+    anyway the holder's next check_leases() raises LeaseLost, so it stops
+    before writing over another holder.
+
+    Raises:
+        TimeoutError: The lease could not be taken within timeout seconds
+    """
+    holder = f'{worker_name()}:{uuid.uuid4().hex[:8]}'
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        with connect(db_path) as conn:
+            if _acquire(conn, name, holder, ttl):
+                break
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"Could not lease {name} within {timeout} seconds")
+        time.sleep(WAIT_INTERVAL)
+
+    released = threading.Event()
+    lost = threading.Event()
+
+    def renew():
+        renewed_at = time.time()
+        interval = ttl / 3
+        while not released.wait(interval):
+            try:
+                with connect(db_path) as conn:
+                    held = _acquire(conn, name, holder, ttl)
+            except sqlite3.Error:
+                held = None
+            if held:
+                renewed_at, interval = time.time(), ttl / 3
+            elif held is False or time.time() > renewed_at + ttl:
+                # Taken over, or expired while renewals failed and possibly taken meanwhile
+                lost.set()
+                return
+            else:
+                interval = RENEW_RETRY_SECONDS
+
+    threading.Thread(target=renew, daemon=True).start()
+    token = _held_leases.set(_held_leases.get() + ((name, lost),))
+    try:
+        yield
+    finally:
+        _held_leases.reset(token)
+        released.set()
+        with connect(db_path) as conn:
+            _release(conn, name, holder)
+
+def check_leases():
+    """
+    Raise LeaseLost when a lease held in the current context was lost
+
+    Called before each write a lease protects.
+    """
+    for name, lost in _held_leases.get():
+        if lost.is_set():
+            raise LeaseLost(f"Lease on {name} was lost, write aborted")
+
+def sheet_lease(sh, sheet_name, **kwargs):
+    """Lease on one worksheet, for read-modify-write sequences that must not interleave"""
+    return lease(f'sheet:{sh.id}:{sheet_name}', **kwargs)
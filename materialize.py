@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import pandas as pd
+from gspread.utils import rowcol_to_a1, ValueInputOption
+from tenants import tenant_path
+from leases import check_leases
+
+# Fingerprints of the source rows behind the materialized 데이터 종합/배송 rows
+STATE_PATH = os.path.join('.cache', 'delivery_view_state.json')
+
+# Beyond this many delivery keys the fingerprints not seen for longest are dropped
+MAX_STATE_KEYS = 100000
+
+
+def load_state(path=None):
+    """Load the refresh state, empty on the first run"""
+    path = path or tenant_path(STATE_PATH)
+    if not os.path.exists(path):
+        return {'reference': None, 'deliveries': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state, path=None):
+    """
+    Persist the refresh state atomically
+
+    Fingerprints are kept in the order they were last refreshed (see
+    refresh_fingerprints), so trimming drops the least recently seen keys.
+    """
+    path = path or tenant_path(STATE_PATH)
+    deliveries = state['deliveries']
+    if len(deliveries) > MAX_STATE_KEYS:
+        state['deliveries'] = dict(list(deliveries.items())[-MAX_STATE_KEYS:])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def refresh_fingerprints(known, fingerprints, recomputed):
+    """
+    Known fingerprints with those of the current source rows moved to the end
+
+    Args:
+        known (dict): Fingerprints of the last refresh
+        fingerprints (dict): Fingerprints of the current source rows
+        recomputed (iterable): Keys whose view rows were just rewritten
+
+    Returns:
+        dict: Keys absent from the source first, then the current keys whose
+            view rows are up to date
+    """
+    recomputed = set(recomputed)
+    refreshed = {key: value for key, value in known.items() if key not in fingerprints}
+    refreshed.update((key, fingerprint) for key, fingerprint in fingerprints.items()
+                     if key in recomputed or known.get(key) == fingerprint)
+    return refreshed
+
+def frame_fingerprint(*frames):
+    """Content hash of one or more DataFrames"""
+    digest = hashlib.sha1()
+    for df in frames:
+        digest.update(pd.util.hash_pandas_object(df.astype(str), index=False).values.tobytes())
+    return digest.hexdigest()
+
+def key_fingerprints(df, key_col):
+    """
+    Content hash of all rows sharing each key, independent of row order
+
+    Returns:
+        dict: {key: fingerprint}
+    """
+    if df.empty:
+        return {}
+    hashed = pd.Series(pd.util.hash_pandas_object(df.astype(str), index=False).values,
+                       index=df[key_col].values)
+    return hashed.groupby(level=0).agg(
+        lambda h: hashlib.sha1(h.sort_values().values.tobytes()).hexdigest()).to_dict()
+
+def covering_keys(key_cells, keys, separator='\n'):
+    """
+    Every component key of the key cells that share a component with keys
+
+    Recomputing only some of the keys of a consolidated row would overwrite
+    the row without the others, so a refresh widens its keys to these.
+    """
+    keys = set(keys)
+    covering = set(keys)
+    for parts in key_cells.astype(str).str.split(separator):
+        if not keys.isdisjoint(parts):
+            covering.update(part for part in parts if part)
+    return covering
+
+def changed_keys(fingerprints, known):
+    """Keys whose fingerprint is new or differs from the known one"""
+    return [key for key, fingerprint in fingerprints.items() if known.get(key) != fingerprint]
+
+def upsert_rows(worksheet, existing_df, data, key_col, separator='\n'):
+    """
+    Upsert rows into a worksheet keyed by `key_col`
+
+    A key cell may hold several component keys joined by `separator`
+    (a consolidated delivery lists all its 배송 key values). A new row
+    replaces the existing row with the same key cell, or else the first
+    free row sharing a component key. Other existing rows sharing component
+    keys are stale and deleted. Rows without a match are appended and
+    identical rows are left untouched.
+
+    An existing row is only replaced or deleted when all of its component
+    keys are among the upserted ones, so no key can silently drop out of
+    the sheet; widen the upserted rows with covering_keys first.
+
+    Args:
+        worksheet: gspread Worksheet with the columns of `data` from column A
+        existing_df (pandas.DataFrame): Current worksheet content, header excluded
+        data (pandas.DataFrame): Rows to upsert
+
+    Returns:
+        dict: Number of rows appended, updated, deleted and unchanged
+
+    Raises:
+        ValueError: A replaced or deleted row holds keys that are not upserted
+    """
+    columns = list(data.columns)
+    key_position = columns.index(key_col)
+    existing = existing_df.reset_index(drop=True).reindex(columns=columns).fillna('').astype(str)
+    new_values = data.fillna('').astype(str)
+
+    # Existing rows by full key cell and by each component key
+    exact_rows = pd.Series(existing.index).groupby(existing[key_col].values).apply(list).to_dict()
+    components = existing[key_col].str.split(separator).explode()
+    components = components[components != '']
+    rows_of_component = pd.Series(components.index).groupby(components.values).apply(list).to_dict()
+
+    rows = list(new_values.itertuples(index=False, name=None))
+    targets = [None] * len(rows)
+    claimed, touched = set(), set()
+
+    # Rows with an identical key cell are matched first, then rows sharing a component key
+    for i, row in enumerate(rows):
+        free = [p for p in exact_rows.get(row[key_position], []) if p not in claimed]
+        if free:
+            targets[i] = free[0]
+            claimed.add(free[0])
+    for i, row in enumerate(rows):
+        overlapping = sorted({p for key in row[key_position].split(separator)
+                              for p in rows_of_component.get(key, [])})
+        touched.update(overlapping)
+        if targets[i] is None:
+            free = [p for p in overlapping if p not in claimed]
+            if free:
+                targets[i] = free[0]
+                claimed.add(free[0])
+    # Existing rows overlapping the new rows but not reused are stale
+    absorbed = touched - claimed
+
+    upserted_keys = {key for row in rows for key in row[key_position].split(separator)}
+    for position in sorted(touched | claimed):
+        dropped = set(existing.iloc[position][key_col].split(separator)) - upserted_keys - {''}
+        if dropped:
+            raise ValueError(f"Row {position + 2} also holds {sorted(dropped)}, which are not upserted")
+
+    updates, appends = [], []
+    unchanged = 0
+    for row, target in zip(rows, targets):
+        if target is None:
+            appends.append(list(row))
+        elif tuple(existing.iloc[target]) == row:
+            unchanged += 1
+        else:
+            updates.append((target, list(row)))
+
+    # Rows are written by position: each write first checks that no lease held around
+    # the upsert was lost. Sheet rows are 1-based and the header takes the first row
+    if updates:
+        check_leases()
+        worksheet.batch_update(
+            [{'range': f'{rowcol_to_a1(position + 2, 1)}:{rowcol_to_a1(position + 2, len(columns))}',
+              'values': [values]} for position, values in updates],
+            value_input_option=ValueInputOption.user_entered)
+    # One request for all deletes, bottom-up so earlier row numbers stay valid
+    if absorbed:
+        check_leases()
+        worksheet.spreadsheet.batch_update({'requests': [
+            {'deleteDimension': {'range': {'sheetId': worksheet.id, 'dimension': 'ROWS',
+                                           'startIndex': position + 1, 'endIndex': position + 2}}}
+            for position in sorted(absorbed, reverse=True)]})
+    if appends:
+        check_leases()
+        worksheet.append_rows(appends, value_input_option=ValueInputOption.user_entered,
+                              insert_data_option='INSERT_ROWS', table_range='A1')
+
+    return {'appended': len(appends), 'updated': len(updates),
+            'deleted': len(absorbed), 'unchanged': unchanged}
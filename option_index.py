@@ -0,0 +1,141 @@
+import os
+import pickle
+import hashlib
+import threading
+import pandas as pd
+from progress import notify, preview
+from key_index import KeyIndex
+from tenants import tenant_path
+
+# Separator between the normalized product id and option name. It can not
+# survive normalization, so two different pairs never produce the same key.
+KEY_SEPARATOR = '\x1f'
+
+# Built index of the current 옵션 sheet, shared by worker and pool processes
+INDEX_CACHE_PATH = os.path.join('.cache', 'option_index.pkl')
+
+# Per process copy of the on-disk index, keyed by cache path
+_index_cache = {}
+_index_lock = threading.Lock()
+
+
+def normalize_key_part(values):
+    """
+    Normalize a Series of product ids or option names for matching:
+    - Unicode NFKC normalization (full-width characters, compatibility forms)
+    - Lowercase
+    - Runs of whitespace collapsed to one space, leading and trailing removed
+    Punctuation is kept: "1+1 세트" and "11 세트" are different options.
+    Missing values and the literal 'nan' become empty strings.
+    """
+    values = values.fillna('').astype(str).replace('nan', '')
+    return (values.str.normalize('NFKC')
+                  .str.lower()
+                  .str.replace(r'\s+', ' ', regex=True)
+                  .str.strip())
+
+def make_option_keys(product_ids, option_names):
+    """Build normalized lookup keys from (상품 id, 옵션 이름) Series"""
+    return normalize_key_part(product_ids) + KEY_SEPARATOR + normalize_key_part(option_names)
+
+def _fingerprint(option_df):
+    """Content hash of the columns the index is built from"""
+    hashed = pd.util.hash_pandas_object(option_df[['옵션 id', '옵션 key']], index=False)
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+def build_option_index(option_df):
+    """
+    Build a normalized (상품 id, 옵션 이름) -> 옵션 key lookup from the 옵션 sheet
+
+    '옵션 id' is stored as 상품 id + '_' + 옵션 이름, so it is split on the
+    first underscore. Rows that normalize to the same key but carry
+    different 옵션 keys are ambiguous; they are left out of the index so
+    their orders show up as unmatched instead of getting either key.
+
+    Returns:
+        tuple: (KeyIndex of 옵션 key values by normalized key,
+                DataFrame of the colliding 옵션 rows)
+    """
+    parts = option_df['옵션 id'].astype(str).str.strip().str.partition('_')
+    keys = make_option_keys(parts[0], parts[2])
+    option_keys = option_df['옵션 key']
+
+    distinct = pd.DataFrame({'key': keys.values, '옵션 key': option_keys.astype(str).values}).drop_duplicates()
+    ambiguous = keys.isin(distinct.loc[distinct['key'].duplicated(), 'key'])
+    collisions = option_df.loc[ambiguous.values, ['옵션 id', '옵션 key']].assign(
+        **{'정규화 key': keys[ambiguous].str.replace(KEY_SEPARATOR, ' | ')})
+    return KeyIndex(keys[~ambiguous].values, option_keys[~ambiguous].values), collisions
+
+def _load_cached_index(path, fingerprint):
+    cached = _index_cache.get(path)
+    if cached is None and os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                cached = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            cached = None
+    if cached is not None and cached[0] == fingerprint:
+        _index_cache[path] = cached
+        return cached
+    return None
+
+def get_option_index(option_df, cache_path=None):
+    """
+    Return the option index of the 옵션 sheet, rebuilding it only if the sheet changed
+
+    The built index is pickled next to the reference cache, so worker and
+    backfill pool processes load it instead of normalizing every option
+    again. Colliding options are reported on every use, until the 옵션
+    sheet is fixed.
+    """
+    cache_path = cache_path or tenant_path(INDEX_CACHE_PATH)
+    fingerprint = _fingerprint(option_df)
+    with _index_lock:
+        cached = _load_cached_index(cache_path, fingerprint)
+        if cached is None:
+            cached = (fingerprint, *build_option_index(option_df))
+            os.makedirs(os.path.dirname(cache_path) or '.', exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(cached, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+            _index_cache[cache_path] = cached
+
+    _, option_index, collisions = cached
+    if not collisions.empty:
+        notify('warning', f'{len(collisions)} 개의 옵션이 정규화 후 같은 key 가 되어 매칭에서 제외됨 - 옵션 시트를 확인하세요')
+        preview('정규화 후 충돌하는 옵션', collisions, always=True)
+    return option_index
+
+def lookup_option_keys(option_index, product_ids, option_names, order_ids):
+    """
+    Map order rows to their 옵션 key in one vectorized pass
+
+    Args:
+        option_index (KeyIndex): Index from get_option_index
+        product_ids (pandas.Series): 상품 id of each order row
+        option_names (pandas.Series): 옵션 이름 of each order row
+        order_ids (pandas.Series): 주문번호 of each order row, used in the report
+
+    Returns:
+        tuple: (옵션 key Series aligned to product_ids.index,
+                DataFrame of the rows that did not match any option)
+    """
+    option_keys = option_index.lookup(make_option_keys(product_ids, option_names))
+
+    unmatched = option_keys.isna()
+    option_names = option_names.fillna('').astype(str).replace('nan', '')
+    unmatched_report = pd.DataFrame({
+        '주문번호': order_ids[unmatched],
+        '상품 id': product_ids[unmatched],
+        '옵션 이름': option_names[unmatched],
+        '옵션 id': (product_ids.astype(str) + '_' + option_names)[unmatched]
+    })
+    return option_keys, unmatched_report
+
+def report_unmatched_options(unmatched_report):
+    """Show order rows without a matching option so missing SKUs are found before processing"""
+    if unmatched_report.empty:
+        return
+    notify('warning', f'{len(unmatched_report)} 건의 주문 옵션 매칭 실패 - 옵션 시트를 확인하세요')
+    preview('매칭되지 않은 옵션', unmatched_report, always=True)
@@ -0,0 +1,254 @@
+import threading
+import contextvars
+from contextlib import nullcontext
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from common_processor import update_worksheet, read_columns
+from delivery_view import load_and_process_data, read_source
+from export import export_deliveries
+from demand import update_demand
+from platforms import get_processor
+from progress import notify, report_stage
+from journal import journal_stage
+from leases import sheet_lease
+from profiling import stage_profile
+
+DEFAULT_MAX_WORKERS = 4
+
+# Stages that read a worksheet to decide which rows to append to it (customer dedup).
+# They hold the worksheet's lease so concurrent uploads cannot both append the same
+# rows; plain appends need no lease as the append API places them atomically.
+LEASED_STAGES = {'customer': '고객'}
+
+# Columns identifying a row of the worksheets stages append to, for replays
+REPLAY_KEYS = {'고객': ['고객 휴대폰', '플랫폼'], '주문': ['주문 key'], '배송': ['배송 key']}
+
+
+class Stage:
+    """
+    One step of the upload pipeline
+
+    Args:
+        name (str): Unique stage name
+        func (callable): Called with a dict of the stage's input values
+        inputs (list): Outputs of other stages this stage consumes. The stage
+            is skipped when any of them is missing or has no rows.
+        after (list): Stages that must finish first, whatever they produced.
+            The stage is skipped when any of them failed.
+        outputs (list): Names of the values returned by func. With several
+            outputs func must return a dict keyed by output name.
+    """
+
+    def __init__(self, name, func, inputs=(), after=(), outputs=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.after = list(after)
+        self.outputs = list(outputs) if outputs is not None else [name]
+
+
+def _has_rows(value):
+    """False for missing values and empty DataFrames"""
+    if value is None:
+        return False
+    if isinstance(value, pd.DataFrame):
+        return not value.empty
+    return True
+
+def _check_graph(stages):
+    """Map every output to its producing stage and reject unknown dependencies"""
+    producers = {}
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"Output '{output}' is produced by more than one stage")
+            producers[output] = stage.name
+    for stage in stages:
+        missing = [i for i in stage.inputs if i not in producers] + [a for a in stage.after if a not in names]
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown {missing}")
+    return producers
+
+def run_stages(stages, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Run stages as soon as their dependencies are finished, independent stages in parallel
+
+    Returns:
+        tuple: (dict of output values, dict of stage name -> 'done' | 'skipped' | 'failed',
+                dict of stage name -> exception for failed stages)
+    """
+    producers = _check_graph(stages)
+    script_ctx = get_script_run_ctx()
+    values, statuses, errors = {}, {}, {}
+    pending = list(stages)
+    running = {}
+
+    def run(stage, stage_inputs):
+        # Keep st.* calls from worker threads attached to the current page
+        if script_ctx is not None:
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+        with stage_profile(stage.name):
+            return stage.func(stage_inputs)
+
+    def finish(stage, status, result=None):
+        statuses[stage.name] = status
+        report_stage(stage.name, status)
+        if status == 'done' and len(stage.outputs) > 1:
+            values.update({output: result.get(output) for output in stage.outputs})
+        else:
+            values.update({output: result for output in stage.outputs})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for stage in list(pending):
+                upstream = [producers[i] for i in stage.inputs] + stage.after
+                if not all(name in statuses for name in upstream):
+                    continue
+                pending.remove(stage)
+                failed = [name for name in stage.after if statuses[name] == 'failed']
+                if failed:
+                    notify('warning', f"{stage.name} stage skipped, {', '.join(failed)} failed")
+                    finish(stage, 'skipped')
+                    continue
+                if not all(_has_rows(values[i]) for i in stage.inputs):
+                    # Upstream produced no new rows (or failed), nothing to do downstream
+                    finish(stage, 'skipped')
+                    continue
+                stage_inputs = {i: values[i] for i in stage.inputs}
+                report_stage(stage.name, 'running')
+                # Copy the context so the run's reporter is visible in the worker
+                running[pool.submit(contextvars.copy_context().run, run, stage, stage_inputs)] = stage
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Dependency cycle between {[stage.name for stage in pending]}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    finish(stage, 'done', future.result())
+                except Exception as e:
+                    errors[stage.name] = e
+                    finish(stage, 'failed')
+
+    return values, statuses, errors
+
+def stage_lease(sh, stage):
+    """Lease on the worksheet a stage reads before appending to it, if any"""
+    sheet_name = LEASED_STAGES.get(stage)
+    return sheet_lease(sh, sheet_name) if sheet_name else nullcontext()
+
+def replay_stage(journal, stage, sh):
+    """
+    Write the rows a stage computed in an earlier attempt without recomputing them
+
+    The earlier attempt may have appended them before it crashed, or may
+    still be running when a stale job was requeued, so rows whose key is
+    already in the worksheet are left out. All journaled rows are returned
+    so downstream stages still see every row of the run.
+    """
+    entry = journal.entry(stage)
+    data = journal.output(stage)
+    keys = REPLAY_KEYS.get(entry['sheet'])
+    unwritten = data
+    if keys and not data.empty:
+        existing = read_columns(entry['sheet'], sh, keys)
+        written = pd.MultiIndex.from_frame(data[keys].astype(str)).isin(
+            pd.MultiIndex.from_frame(existing[keys].astype(str)))
+        unwritten = data[~written]
+    update_worksheet(unwritten, entry['sheet'], entry['success_msg'], sh, history_kind=entry['history_kind'])
+    journal.mark_committed(stage)
+    return data
+
+def build_upload_stages(platform, df, sh, spread, journal):
+    """
+    Stages for one uploaded file
+
+    Deliveries only depend on the upload, and orders need the customer
+    sheet only for the 고객 key lookup, so the delivery stage runs alongside
+    customer -> order. Each source sheet of the delivery view is prefetched
+    as soon as the stage writing it has committed, reading only the rows
+    this run wrote, and the view refreshes exactly the deliveries this run
+    committed. It is skipped when no new orders or deliveries were written. The recomputed
+    deliveries are then exported as courier upload file and picking list.
+    The SKU demand aggregate is updated from the new orders and deliveries
+    alone, without waiting for the view.
+
+    Every stage writes through the journal: committed customer/order/delivery
+    stages are not run again and rows computed by an earlier attempt are
+    written as journaled. The view's consolidated rows are journaled as well once it committed, so
+    a resumed run still exports them although the view has nothing left to
+    recompute.
+    """
+    def process(stage):
+        def execute():
+            status = journal.status(stage)
+            if status == 'committed':
+                notify('info', f"{stage} stage already committed, using journaled rows")
+                return journal.output(stage)
+            if status == 'computed':
+                return replay_stage(journal, stage, sh)
+            with journal_stage(journal, stage):
+                return get_processor(platform, stage)(df, sh, spread)
+
+        def run(_):
+            with stage_lease(sh, stage):
+                return execute()
+        return run
+
+    def read(sheet_name):
+        return lambda _: read_source(sheet_name, sh)
+
+    def read_keyed(sheet_name, output, key_col):
+        return lambda inputs: read_source(sheet_name, sh, inputs[output][key_col].unique())
+
+    def refresh_view(sources):
+        if journal.status('delivery_view') == 'committed':
+            notify('info', "delivery_view stage already committed, using journaled rows")
+            return journal.output('delivery_view')
+        delivery_keys = sources.pop('new_deliveries')['배송 key']
+        consolidated = load_and_process_data(delivery_keys, prefetched=sources)
+        if consolidated is not None:
+            journal.record_committed('delivery_view', consolidated)
+        return consolidated
+
+    return [
+        Stage('customer', process('customer'), outputs=['new_customers']),
+        Stage('order', process('order'), after=['customer'], outputs=['new_orders']),
+        Stage('delivery', process('delivery'), outputs=['new_deliveries']),
+
+        # Prefetch delivery view sources
+        Stage('prefetch_option_sku', read('옵션 스큐 연결'), outputs=['옵션 스큐 연결']),
+        Stage('prefetch_sku', read('스큐'), outputs=['스큐']),
+        Stage('prefetch_customers', read('고객'), after=['customer'], outputs=['고객']),
+        Stage('prefetch_orders', read_keyed('주문', 'new_orders', '주문 key'),
+              inputs=['new_orders'], outputs=['주문']),
+        Stage('prefetch_deliveries', read_keyed('배송', 'new_deliveries', '배송 key'),
+              inputs=['new_deliveries'], outputs=['배송']),
+
+        Stage('delivery_view', refresh_view,
+              inputs=['new_deliveries', '배송', '주문', '고객', '옵션 스큐 연결', '스큐'],
+              outputs=['consolidated']),
+        Stage('export', lambda inputs: export_deliveries(inputs['consolidated']), inputs=['consolidated']),
+        Stage('demand', lambda inputs: update_demand(inputs['new_deliveries'], inputs['new_orders'],
+                                                     inputs['옵션 스큐 연결'], inputs['스큐']),
+              inputs=['new_deliveries', 'new_orders', '옵션 스큐 연결', '스큐']),
+    ]
+
+def run_journaled_upload(journal, sh, spread, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Run or resume a journaled upload from its saved input
+
+    The journal is discarded once every stage succeeded, the delivery view
+    included; otherwise it is kept so the run can be resumed.
+    """
+    platform = journal.manifest['platform']
+    stages = build_upload_stages(platform, journal.load_input(), sh, spread, journal)
+    values, statuses, errors = run_stages(stages, max_workers=max_workers)
+    if not errors and all(journal.status(stage) == 'committed' for stage in ('customer', 'order', 'delivery')):
+        journal.discard()
+    return values, statuses, errors
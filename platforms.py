@@ -0,0 +1,109 @@
+import io
+import importlib
+import pandas as pd
+from common_processor import read_naver_excel
+from validation import PLATFORM_SCHEMAS
+
+# Platform name shown in the app -> how to read its export and which processors to run
+# Processor modules are imported on first use, so startup does not pay for all five
+PLATFORMS = {
+    "11번가": {
+        'header': 1,
+        'module': 'eleven_processor',
+        'customer': 'process_eleven_customer',
+        'order': 'process_eleven_order',
+        'delivery': 'process_eleven_delivery',
+        'rows': 'build_eleven_rows',
+    },
+    "네이버/스토어": {
+        'header': 1,
+        'encrypted': True,
+        'module': 'naver_processor',
+        'customer': 'process_naver_customer',
+        'order': 'process_naver_order',
+        'delivery': 'process_naver_delivery',
+        'rows': 'build_naver_rows',
+    },
+    "쿠팡": {
+        'module': 'coupang_processor',
+        'customer': 'process_coupang_customer',
+        'order': 'process_coupang_order',
+        'delivery': 'process_coupang_delivery',
+        'rows': 'build_coupang_rows',
+    },
+    "올웨이즈": {
+        'module': 'always_processor',
+        'customer': 'process_always_customer',
+        'order': 'process_always_order',
+        'delivery': 'process_always_delivery',
+        'rows': 'build_always_rows',
+    },
+    "옥션/지마켓": {
+        'module': 'auction_processor',
+        'customer': 'process_auction_customer',
+        'order': 'process_auction_order',
+        'delivery': 'process_auction_delivery',
+        'rows': 'build_auction_rows',
+    },
+}
+
+
+def get_processor(platform, stage):
+    """
+    Processor function of a platform for 'customer', 'order' or 'delivery'
+
+    'rows' gives the pure transform of a whole export used by the backfill.
+    """
+    config = PLATFORMS[platform]
+    return getattr(importlib.import_module(config['module']), config[stage])
+
+def read_upload(platform, uploaded_file):
+    """Read an uploaded export file for the given platform into a DataFrame"""
+    config = PLATFORMS[platform]
+    if config.get('encrypted'):
+        return read_naver_excel(uploaded_file, header=config.get('header', 0))
+    return pd.read_excel(uploaded_file, header=config.get('header', 0))
+
+# Encrypted Office files are OLE compound documents; plain xlsx files are zip archives
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+def _is_encrypted(file_bytes):
+    if not file_bytes.startswith(OLE_SIGNATURE):
+        return False
+    import msoffcrypto  # Only needed for OLE files (encrypted or legacy .xls)
+
+    try:
+        return msoffcrypto.OfficeFile(io.BytesIO(file_bytes)).is_encrypted()
+    except Exception:
+        return False
+
+def detect_platform(file_bytes):
+    """
+    Guess the platform of an uploaded export from its header rows only
+
+    Encrypted files can only be Naver exports. Otherwise just the first
+    rows are parsed and each platform's header row (header offset included)
+    is matched against the columns its processors require.
+
+    Returns:
+        str: Platform name, None when no platform or more than one matches
+    """
+    if _is_encrypted(file_bytes):
+        candidates = [platform for platform, config in PLATFORMS.items() if config.get('encrypted')]
+        return candidates[0] if len(candidates) == 1 else None
+
+    sniff_rows = max(config.get('header', 0) for config in PLATFORMS.values()) + 1
+    try:
+        rows = pd.read_excel(io.BytesIO(file_bytes), header=None, nrows=sniff_rows, dtype=str).fillna('')
+    except Exception:
+        return None
+
+    matches = []
+    for platform, config in PLATFORMS.items():
+        header_row = config.get('header', 0)
+        if config.get('encrypted') or header_row >= len(rows):
+            continue
+        header = set(rows.iloc[header_row].str.strip())
+        if set(PLATFORM_SCHEMAS[platform]['required']) <= header:
+            matches.append(platform)
+    return matches[0] if len(matches) == 1 else None
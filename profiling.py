@@ -0,0 +1,311 @@
+import io
+import os
+import ssl
+import sys
+import time
+import socket
+import selectors
+import zipfile
+import threading
+import contextvars
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from progress import notify
+from tenants import tenant_path
+
+PROFILE_DIR = 'profiles'
+
+# Set to 1 to profile every run, not only the ones requested from the page
+PROFILE_RUNS = os.environ.get('PROFILE_RUNS', '') == '1'
+
+SAMPLE_INTERVAL = 0.005
+TOP_N = 20
+# Frames kept per allocation traceback. Every extra frame slows allocation heavy
+# pandas code further (25 frames made a groupby run ~40x slower), so by default
+# allocations are attributed to the allocating line only; raise it to trace
+# them back to processor code when digging into memory.
+TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', '1'))
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Share of a sampling interval a thread must have been on the CPU for its sample to count
+MIN_CPU_SHARE = 0.5
+# Innermost frames of a thread waiting on a lock, socket or selector; only used
+# where per-thread CPU clocks are not available
+WAIT_FILES = {threading.__file__, socket.__file__, ssl.__file__, selectors.__file__}
+
+# Profiler of the run executing in the current context (None when not profiling)
+_current_profiler = contextvars.ContextVar('current_profiler', default=None)
+# Stage executing in the current context, so worker threads it starts are sampled too
+_current_stage = contextvars.ContextVar('current_stage', default=None)
+
+# tracemalloc is process wide; it runs while at least one profiled run is active
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+
+
+def _frame_label(filename, lineno, name):
+    if filename.startswith(REPO_DIR):
+        filename = os.path.relpath(filename, REPO_DIR)
+    else:
+        # Library frames, shortened to the package path
+        parts = filename.split(os.sep)
+        for marker in ('site-packages', 'dist-packages', 'lib'):
+            if marker in parts:
+                filename = os.sep.join(parts[len(parts) - parts[::-1].index(marker):])
+                break
+    return f'{filename}:{lineno} {name}'
+
+def _is_repo_frame(filename):
+    return filename.startswith(REPO_DIR) and filename != __file__
+
+def _start_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _tracing_runs += 1
+
+def _stop_tracing():
+    global _tracing_runs
+    with _tracing_lock:
+        _tracing_runs -= 1
+        if _tracing_runs == 0:
+            tracemalloc.stop()
+
+def _thread_cpu_time(ident):
+    """CPU seconds used by a thread, None where per-thread CPU clocks are not available"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+def _is_own_allocation(stat):
+    """Allocations of the profiler itself: snapshots and samples"""
+    return stat.traceback[-1].filename in (tracemalloc.__file__, __file__)
+
+
+class Profiler:
+    """
+    Sampled CPU profile and allocation snapshots of the stages of one run
+
+    A background thread samples the Python stack of every thread currently
+    running a stage. A sample only counts when the thread's CPU clock
+    advanced for most of the interval, so blocking socket and ssl reads,
+    rate limit sleeps and lock waits are left out and the profile shows
+    where CPU time goes. Without per-thread CPU clocks, frames waiting in
+    socket, ssl, selectors or threading are skipped instead. Worker
+    threads a stage hands work to (AsyncSheetsIO transforms and calls)
+    are sampled as part of that stage. Stages can run concurrently and
+    tracemalloc is process wide, so a stage's allocations can include
+    those of stages running next to it.
+    """
+
+    def __init__(self, name, interval=SAMPLE_INTERVAL, top_n=TOP_N):
+        self.name = name
+        self.interval = interval
+        self.top_n = top_n
+        self.started_at = datetime.now()
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.stacks = Counter()
+        self.durations = {}
+        self.snapshots = {}
+        self.peak = 0
+        self._cpu_times = {}
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True, name='profile-sampler')
+
+    def _on_cpu(self, ident, frame, elapsed):
+        """Whether a thread was computing since the previous sample"""
+        cpu = _thread_cpu_time(ident)
+        if cpu is None:
+            return frame.f_code.co_filename not in WAIT_FILES
+        previous = self._cpu_times.get(ident)
+        self._cpu_times[ident] = cpu
+        return previous is not None and cpu - previous >= MIN_CPU_SHARE * elapsed
+
+    def _sample(self):
+        sampled_at = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, sampled_at = now - sampled_at, now
+            frames = sys._current_frames()
+            with self.lock:
+                threads = dict(self.threads)
+            for ident, stage in threads.items():
+                frame = frames.get(ident)
+                if frame is None or not self._on_cpu(ident, frame, elapsed):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append((frame.f_code.co_filename, frame.f_lineno or 0, frame.f_code.co_name))
+                    frame = frame.f_back
+                with self.lock:
+                    self.stacks[(stage, tuple(reversed(stack)))] += 1
+
+    def start(self):
+        _start_tracing()
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+        self.peak = tracemalloc.get_traced_memory()[1]
+        _stop_tracing()
+
+    @contextmanager
+    def thread(self, name):
+        """Attribute the calling thread's samples to a stage"""
+        ident = threading.get_ident()
+        with self.lock:
+            outer = self.threads.get(ident)
+            self.threads[ident] = name
+        try:
+            yield
+        finally:
+            with self.lock:
+                if outer is None:
+                    del self.threads[ident]
+                else:
+                    self.threads[ident] = outer
+
+    @contextmanager
+    def stage(self, name):
+        """Attribute the calling thread's samples and allocations to a stage"""
+        before = tracemalloc.take_snapshot()
+        started = time.perf_counter()
+        token = _current_stage.set(name)
+        try:
+            with self.thread(name):
+                yield
+        finally:
+            _current_stage.reset(token)
+            self.durations[name] = time.perf_counter() - started
+            # Compared when the profile is saved, to keep it out of the stage's time
+            self.snapshots[name] = (before, tracemalloc.take_snapshot())
+
+    def hot_spots(self):
+        """
+        Sample counts per stage of the hottest frames
+
+        Returns:
+            tuple: (Counter of (stage, innermost repo line), Counter of (stage, leaf line));
+                the repo line is the processor code that made the call, the leaf
+                line where the time was actually spent (often inside pandas)
+        """
+        repo_lines, leaf_lines = Counter(), Counter()
+        for (stage, stack), count in self.stacks.items():
+            leaf_lines[(stage, _frame_label(*stack[-1]))] += count
+            repo = [frame for frame in stack if _is_repo_frame(frame[0])]
+            if repo:
+                repo_lines[(stage, _frame_label(*repo[-1]))] += count
+        return repo_lines, leaf_lines
+
+    def summary(self):
+        """Plain-text report of stage durations, top-N CPU hot spots and allocations"""
+        total = sum(self.stacks.values()) or 1
+        repo_lines, leaf_lines = self.hot_spots()
+        lines = [f'Profile of {self.name}, started {self.started_at:%Y-%m-%d %H:%M:%S}',
+                 f'Sampled every {self.interval * 1000:.0f} ms, {total} on-CPU samples, '
+                 f'peak traced memory {self.peak / 2 ** 20:.1f} MiB, '
+                 f'{TRACEMALLOC_FRAMES} traceback frame(s) per allocation', '']
+
+        lines.append('== Stage durations')
+        for name, seconds in sorted(self.durations.items(), key=lambda item: -item[1]):
+            lines.append(f'{seconds:9.3f} s  {name}')
+
+        for title, counter in (('Hot repo lines (time spent in or below the line)', repo_lines),
+                               ('Hot leaf lines (time spent on the line itself)', leaf_lines)):
+            lines += ['', f'== {title}']
+            for (stage, label), count in counter.most_common(self.top_n):
+                lines.append(f'{100 * count / total:6.1f}%  {stage:<20} {label}')
+
+        lines += ['', '== Allocations per stage (net growth, by innermost repo line traced)']
+        for name, (before, after) in self.snapshots.items():
+            growth = Counter()
+            for stat in after.compare_to(before, 'traceback'):
+                if _is_own_allocation(stat):
+                    continue
+                frame = next((frame for frame in reversed(stat.traceback)
+                              if _is_repo_frame(frame.filename)), stat.traceback[-1])
+                growth[_frame_label(frame.filename, frame.lineno, '').rstrip()] += stat.size_diff
+            lines.append(f'-- {name}: {sum(growth.values()) / 2 ** 20:+.1f} MiB')
+            for label, size in growth.most_common(self.top_n):
+                if size <= 0:
+                    break
+                lines.append(f'{size / 2 ** 10:12.1f} KiB  {label}')
+        return '\n'.join(lines) + '\n'
+
+    def collapsed_stacks(self):
+        """CPU samples as collapsed stacks ('stage;frame;frame count'), for flame graph viewers"""
+        lines = []
+        for (stage, stack), count in self.stacks.most_common():
+            frames = ';'.join(f'{name} ({_frame_label(filename, lineno, "").strip()})'
+                              for filename, lineno, name in stack)
+            lines.append(f'{stage};{frames} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, profile_dir=None):
+        """Write summary, collapsed stacks and allocation snapshots, returns the directory"""
+        profile_dir = profile_dir or tenant_path(PROFILE_DIR)
+        path = os.path.join(profile_dir, f'{self.started_at:%Y%m%d-%H%M%S}-{self.name}')
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'summary.txt'), 'w', encoding='utf-8') as f:
+            f.write(self.summary())
+        with open(os.path.join(path, 'cpu.collapsed'), 'w', encoding='utf-8') as f:
+            f.write(self.collapsed_stacks())
+        # Load with tracemalloc.Snapshot.load to dig further into a stage's allocations
+        for name, (_, snapshot) in self.snapshots.items():
+            snapshot.dump(os.path.join(path, f'{name}.tracemalloc'))
+        return path
+
+
+def stage_profile(name):
+    """Profile a stage when the current run is profiled"""
+    profiler = _current_profiler.get()
+    return profiler.stage(name) if profiler is not None else nullcontext()
+
+def stage_thread():
+    """Sample a worker thread as part of the stage that handed it work, when profiled"""
+    profiler, stage = _current_profiler.get(), _current_stage.get()
+    return profiler.thread(stage) if profiler is not None and stage is not None else nullcontext()
+
+def run_profiled(name, enabled, func, *args):
+    """
+    Run func(*args), profiled when enabled (or PROFILE_RUNS is set)
+
+    The whole call is recorded as the 'run' stage; stages run through the
+    pipeline inside it are recorded on their own.
+    """
+    if not (enabled or PROFILE_RUNS):
+        return func(*args)
+
+    profiler = Profiler(name)
+    token = _current_profiler.set(profiler)
+    profiler.start()
+    try:
+        with profiler.stage('run'):
+            return func(*args)
+    finally:
+        profiler.stop()
+        _current_profiler.reset(token)
+        notify('info', f"Profile saved to {profiler.save()}")
+
+def list_profiles(profile_dir=None, limit=6):
+    """Most recent profile directories, newest first"""
+    profile_dir = profile_dir or tenant_path(PROFILE_DIR)
+    if not os.path.isdir(profile_dir):
+        return []
+    paths = [os.path.join(profile_dir, name) for name in os.listdir(profile_dir)]
+    return sorted(paths, key=os.path.getmtime, reverse=True)[:limit]
+
+def profile_archive(path):
+    """Zip of a profile directory, for downloading"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name in sorted(os.listdir(path)):
+            archive.write(os.path.join(path, name), arcname=name)
+    return buffer.getvalue()
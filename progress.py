@@ -0,0 +1,127 @@
+import streamlit as st
+import threading
+import contextvars
+import traceback
+from datetime import datetime
+
+PREVIEW_PAGE_SIZE = 50
+
+# Reporter of the run executing in the current context (None when running inline)
+_current_reporter = contextvars.ContextVar('current_reporter', default=None)
+
+
+class RunReporter:
+    """
+    Collects progress of a background run so the page can render it
+
+    Processing code does not call st.* directly while a reporter is active;
+    notify, preview and report_stage record here and the page polls.
+    DataFrames are kept by reference and only rendered one page at a time.
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.events = []
+        self.previews = []
+        self.stages = {}
+        self.started_at = datetime.now()
+        self.finished_at = None
+        self.error = None
+
+    def add_event(self, level, message):
+        with self.lock:
+            self.events.append((datetime.now(), level, message))
+
+    def add_preview(self, label, df):
+        with self.lock:
+            self.previews.append((label, df))
+
+    def set_stage(self, name, status):
+        with self.lock:
+            self.stages[name] = status
+
+
+def notify(level, message):
+    """
+    Report a status message ('success', 'info', 'warning' or 'error')
+
+    Without an active reporter the message is shown right away: errors in
+    the main area, everything else in the sidebar.
+    """
+    reporter = _current_reporter.get()
+    if reporter is not None:
+        reporter.add_event(level, message)
+    elif level == 'error':
+        st.error(message)
+    else:
+        getattr(st.sidebar, level)(message)
+
+def preview(label, df, always=False):
+    """
+    Offer a DataFrame for inspection
+
+    Previews are only kept in verbose mode unless `always` is set, so
+    normal runs do not pay for serializing intermediate frames.
+    """
+    reporter = _current_reporter.get()
+    if reporter is not None:
+        if always or reporter.verbose:
+            reporter.add_preview(label, df)
+    elif always:
+        render_paged_preview(label, df, key=f'inline_{label}')
+
+def report_stage(name, status):
+    """Record a stage status change ('running', 'done', 'skipped', 'failed')"""
+    reporter = _current_reporter.get()
+    if reporter is not None:
+        reporter.set_stage(name, status)
+
+def run_reported(reporter, func, *args):
+    """
+    Run func(*args) with reporter receiving its progress; errors are reported, not raised
+
+    Run it in a context of its own (a new thread or a copied context), as
+    the reporter stays set in the current context.
+
+    Returns:
+        The result of func, None when it raised
+    """
+    _current_reporter.set(reporter)
+    try:
+        return func(*args)
+    except Exception as e:
+        reporter.error = e
+        reporter.add_event('error', f"Error processing file: {str(e)}\n{traceback.format_exc()}")
+    finally:
+        reporter.finished_at = datetime.now()
+
+def render_paged_preview(label, df, key):
+    """Render a single page of a DataFrame instead of the whole frame"""
+    page_count = max(1, -(-len(df) // PREVIEW_PAGE_SIZE))
+    page = st.number_input(f'{label} ({len(df)} rows) - page', min_value=1, max_value=page_count,
+                           value=1, key=f'{key}_page')
+    start = (page - 1) * PREVIEW_PAGE_SIZE
+    st.dataframe(df.iloc[start:start + PREVIEW_PAGE_SIZE])
+
+def render_progress(reporter):
+    """Render stage statuses and messages of a run"""
+    with reporter.lock:
+        stages = dict(reporter.stages)
+        events = list(reporter.events)
+
+    if stages:
+        st.dataframe({'stage': list(stages), 'status': list(stages.values())}, hide_index=True)
+    for timestamp, level, message in events:
+        getattr(st, level)(f"{timestamp:%H:%M:%S} {message}")
+
+def render_previews(reporter, key='preview'):
+    """Let the user pick one preview and render it page by page"""
+    with reporter.lock:
+        previews = list(reporter.previews)
+    if not previews:
+        return
+    labels = [f'{i + 1}. {label}' for i, (label, _) in enumerate(previews)]
+    choice = st.selectbox('Preview', labels, key=f'{key}_select')
+    label, df = previews[labels.index(choice)]
+    render_paged_preview(label, df, key=f'{key}_{labels.index(choice)}')
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from jobs import JOBS_DB, connect
+from tenants import current_tenant, load_tenants
+
+# Sheets API requests per minute of the service account, which every tenant shares.
+# Google counts the per-user quota against the account, not against each spreadsheet.
+ACCOUNT_REQUESTS_PER_MINUTE = int(os.environ.get('SHEETS_REQUESTS_PER_MINUTE', 60))
+
+# Requests that may go out back to back before the steady rate applies
+BURST = 10
+
+# Requests in flight per process, whichever code path sends them
+MAX_CONCURRENCY = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS request_quota (
+    bucket TEXT PRIMARY KEY,
+    next_at REAL NOT NULL
+)
+"""
+
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+# Whether the current thread already holds a slot
+_holding = threading.local()
+
+
+@contextmanager
+def request_slot():
+    """
+    Hold one of the process-wide request slots while sending requests
+
+    A thread holds at most one slot: nested uses, e.g. an AsyncSheetsIO
+    call whose client requests take a slot again, share the outer one.
+    """
+    if getattr(_holding, 'slot', False):
+        yield
+        return
+    with _request_slots:
+        _holding.slot = True
+        try:
+            yield
+        finally:
+            _holding.slot = False
+
+def tenant_share(name, tenants=None):
+    """
+    Requests per minute a tenant may use out of the account's quota
+
+    A tenant's requests_per_minute is capped at the account rate; tenants
+    without one get an equal part of it. The account bucket is always
+    checked as well, so shares that add up to more than the account rate
+    only let an idle tenant's part go to the busy ones.
+    """
+    tenants = tenants or load_tenants()
+    share = tenants[name].get('requests_per_minute') or ACCOUNT_REQUESTS_PER_MINUTE / len(tenants)
+    return min(share, ACCOUNT_REQUESTS_PER_MINUTE)
+
+def _reserve(conn, buckets, burst):
+    """
+    Reserve the next send time that fits every (bucket, interval) and return it
+
+    Generic cell rate algorithm: each bucket stores the time its next
+    request is due, and a request may go out up to burst intervals early.
+    """
+    now = time.time()
+    due = dict(conn.execute(
+        f"SELECT bucket, next_at FROM request_quota WHERE bucket IN ({','.join('?' * len(buckets))})",
+        [name for name, _ in buckets]).fetchall())
+    send_at = max([now] + [due.get(name, now) - burst * interval for name, interval in buckets])
+    conn.executemany(
+        'INSERT INTO request_quota (bucket, next_at) VALUES (?, ?) '
+        'ON CONFLICT (bucket) DO UPDATE SET next_at = excluded.next_at',
+        [(name, max(due.get(name, now), send_at) + interval) for name, interval in buckets])
+    return send_at
+
+def wait_for_quota(tenant=None, burst=BURST, db_path=JOBS_DB):
+    """
+    Block until the current tenant may send one Sheets API request
+
+    The request counts against the account bucket and the tenant's share.
+    Both live in the jobs database, so the limits hold across the app and
+    every worker process.
+    """
+    tenant = tenant or current_tenant()
+    buckets = [('account', 60 / ACCOUNT_REQUESTS_PER_MINUTE),
+               (f'tenant:{tenant}', 60 / tenant_share(tenant))]
+    with connect(db_path) as conn:
+        conn.execute(_SCHEMA)
+        # Take the write lock before reading, so two processes can not reserve the same slot
+        conn.execute('BEGIN IMMEDIATE')
+        send_at = _reserve(conn, buckets, burst)
+    wait = send_at - time.time()
+    if wait > 0:
+        time.sleep(wait)
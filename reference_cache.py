@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import pandas as pd
+from common_processor import load_the_spreadsheet, read_columns, read_probe
+
+CACHE_DIR = os.path.join('.cache', 'reference')
+
+# Reference worksheets cached on disk -> the columns that are read and cached
+REFERENCE_SHEETS = {
+    '옵션': ['옵션 id', '옵션 key', '상품 id', '옵션 할인금액'],
+    '옵션 스큐 연결': ['옵션 key', 'SKU key', 'SKU 수량'],
+    '스큐': ['SKU key', 'SKU 이름'],
+}
+
+# One Drive metadata request serves all reference reads within this many seconds
+MODIFIED_TIME_TTL = 10
+
+# Trailing rows of the used columns included in a worksheet's probe
+PROBE_ROWS = 5
+
+# The probe misses in-place edits above the last rows outside the first column,
+# so a cached worksheet is fully fetched again after this many seconds anyway
+FULL_REFRESH_SECONDS = 600
+
+_modified_times = {}
+_lock = threading.Lock()
+
+
+def _modified_time(sh):
+    """Spreadsheet modifiedTime from the Drive API, shared briefly between reads"""
+    with _lock:
+        cached = _modified_times.get(sh.id)
+        if cached and time.monotonic() - cached[0] < MODIFIED_TIME_TTL:
+            return cached[1]
+    modified_time = sh.client.get_file_drive_metadata(sh.id)['modifiedTime']
+    with _lock:
+        _modified_times[sh.id] = (time.monotonic(), modified_time)
+    return modified_time
+
+def _probe(sheet_name, sh, rows):
+    """Checksum of a worksheet's header, first used column and last rows, from one small batchGet"""
+    probed = read_probe(sheet_name, sh, REFERENCE_SHEETS[sheet_name], rows, PROBE_ROWS)
+    return hashlib.sha1(json.dumps(probed, ensure_ascii=False).encode()).hexdigest()
+
+def get_reference_sheet(sheet_name, sh, cache_dir=CACHE_DIR):
+    """
+    Load a reference worksheet through the on-disk cache
+
+    Revalidation is cheap and works from a cold session: while the
+    spreadsheet's modifiedTime is unchanged since the cache was written no
+    Sheets request is made at all. Uploads append to other worksheets of
+    the same spreadsheet and change its modifiedTime, so the worksheet
+    itself is then probed with one small batchGet (header, first column
+    and last rows); only when the probe differs are the used columns
+    fetched again. In-place edits the probe can not see are picked up by
+    the full fetch every FULL_REFRESH_SECONDS.
+    """
+    sheet_dir = os.path.join(cache_dir, sh.id)
+    data_path = os.path.join(sheet_dir, f'{sheet_name}.pkl')
+    meta_path = os.path.join(sheet_dir, f'{sheet_name}.json')
+
+    modified_time = _modified_time(sh)
+    if os.path.exists(meta_path) and os.path.exists(data_path):
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['modified_time'] == modified_time:
+            return pd.read_pickle(data_path)
+        fresh = time.time() - meta.get('fetched_at', 0) < FULL_REFRESH_SECONDS
+        if fresh and 'probe' in meta and _probe(sheet_name, sh, meta['rows']) == meta['probe']:
+            _write_meta(meta_path, {**meta, 'modified_time': modified_time})
+            return pd.read_pickle(data_path)
+
+    df = read_columns(sheet_name, sh, REFERENCE_SHEETS[sheet_name])
+    os.makedirs(sheet_dir, exist_ok=True)
+    tmp_path = data_path + '.tmp'
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, data_path)
+    _write_meta(meta_path, {'modified_time': modified_time, 'fetched_at': time.time(), 'rows': len(df),
+                            'probe': _probe(sheet_name, sh, len(df))})
+    return df
+
+def _write_meta(meta_path, meta):
+    tmp_path = meta_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+
+def load_sheet(sheet_name, sh, columns=None):
+    """
+    Load any worksheet, going through the cache for reference worksheets
+
+    Args:
+        columns (list): Read only these columns of a non-reference worksheet
+    """
+    if sheet_name in REFERENCE_SHEETS:
+        return get_reference_sheet(sheet_name, sh)
+    if columns is not None:
+        return read_columns(sheet_name, sh, columns)
+    return load_the_spreadsheet(sheet_name, sh)
@@ -0,0 +1,112 @@
+import os
+import json
+import pandas as pd
+
+# Optional JSON file overriding SETTLEMENT_RULES per platform
+RULES_PATH = os.environ.get('SETTLEMENT_RULES_PATH', 'settlement_rules.json')
+
+# Platform (as written to the 플랫폼 column) -> how its export maps to settlement columns
+#   sale: [column, quantity column or None] terms summed into 판매금액
+#   discount: columns summed into 할인금액
+#   option_discount: also add the 옵션 할인금액 of the row's 옵션 key
+#   fee: columns summed into 플랫폼 비용
+#   fee_rate: share of 판매금액 added to 플랫폼 비용
+#   settlement: column holding 정산금액, or None to compute 판매금액 - 할인금액 - 플랫폼 비용
+SETTLEMENT_RULES = {
+    '11st': {
+        'sale': [['주문금액', None]],
+        'discount': ['판매자기본할인금액', '판매자 추가할인금액'],
+        'fee': ['서비스이용료'],
+        'settlement': '정산예정금액',
+    },
+    '네이버': {
+        'sale': [['상품가격', None], ['옵션가격', '수량']],
+        'option_discount': True,
+        'fee': ['네이버페이 주문관리 수수료', '매출연동 수수료'],
+        'settlement': '정산예정금액',
+    },
+    '쿠팡': {
+        'sale': [['결제액', None]],
+        'option_discount': True,
+        'fee_rate': 0.1166,
+        'settlement': None,
+    },
+    '올웨이즈': {
+        'sale': [['상품가격', None]],
+        'discount': ['올웨이즈 부담 쿠폰할인금', '판매자 부담 쿠폰할인금'],
+        'settlement': '정산대상금액(수수료 제외)',
+    },
+    '옥션': {
+        'sale': [['판매금액', None]],
+        'discount': ['판매자쿠폰할인', '구매쿠폰적용금액', '우수회원할인'],
+        'fee': ['서비스이용료'],
+        'settlement': '정산예정금액',
+    },
+}
+
+
+def load_rules(path=RULES_PATH):
+    """Default rules with any per-platform overrides from the JSON rules file"""
+    rules = {platform: dict(rule) for platform, rule in SETTLEMENT_RULES.items()}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for platform, override in json.load(f).items():
+                rules.setdefault(platform, {}).update(override)
+    return rules
+
+def to_number(values):
+    """Vectorized safe_convert: '1,000' -> 1000, empty or unparseable -> 0"""
+    return pd.to_numeric(values.astype(str).str.replace(',', '').str.strip(), errors='coerce').fillna(0)
+
+def option_discounts(option_df):
+    """옵션 할인금액 keyed by 옵션 key (first row wins, like the option index)"""
+    options = option_df.drop_duplicates('옵션 key')
+    return pd.Series(to_number(options['옵션 할인금액']).values, index=options['옵션 key'].values)
+
+def compute_settlement(df, platform, option_keys=None, option_df=None, rules=None):
+    """
+    Compute 판매금액, 할인금액, 플랫폼 비용 and 정산금액 for an order frame
+
+    Every amount is a vectorized column expression over the whole frame.
+    Option discounts are looked up by 옵션 key, never by row position.
+
+    Args:
+        df (pandas.DataFrame): Cleaned platform export
+        platform (str): Key of the settlement rules, e.g. '쿠팡'
+        option_keys (pandas.Series): 옵션 key per row of df, needed for
+            platforms with option_discount
+        option_df (pandas.DataFrame): The 옵션 sheet, needed with option_keys
+        rules (dict): Rules to use instead of load_rules()
+
+    Returns:
+        pandas.DataFrame: The four amount columns, aligned to df.index
+    """
+    rule = (rules or load_rules())[platform]
+    zero = pd.Series(0.0, index=df.index)
+
+    sale = zero.copy()
+    for column, quantity_column in rule.get('sale', []):
+        term = to_number(df[column])
+        sale += term * to_number(df[quantity_column]) if quantity_column else term
+
+    discount = zero.copy()
+    for column in rule.get('discount', []):
+        discount += to_number(df[column])
+    if rule.get('option_discount'):
+        discount += option_keys.map(option_discounts(option_df)).fillna(0)
+
+    fee = sale * rule.get('fee_rate', 0)
+    for column in rule.get('fee', []):
+        fee += to_number(df[column])
+
+    if rule.get('settlement'):
+        settlement = to_number(df[rule['settlement']])
+    else:
+        settlement = sale - discount - fee
+
+    return pd.DataFrame({
+        '판매금액': sale,
+        '할인금액': discount,
+        '플랫폼 비용': fee,
+        '정산금액': settlement
+    }, index=df.index)
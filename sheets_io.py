@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from common_processor import update_worksheet
+from reference_cache import load_sheet
+from profiling import stage_thread
+from quota import request_slot
+
+
+class AsyncSheetsIO:
+    """
+    asyncio front end for the blocking gspread calls
+
+    Every request runs on a worker thread and holds one of the process-wide
+    request slots (quota.request_slot) while it is sent, so independent
+    reads, appends and CPU transforms can overlap while the number of
+    requests in flight stays at MAX_CONCURRENCY across all instances, event
+    loops and the gspread calls processors make directly.
+    """
+
+    def __init__(self, sh, spread=None):
+        self.sh = sh
+        self.spread = spread
+        # Streamlit only renders st.* calls made from threads attached to the script run
+        self._script_ctx = get_script_run_ctx()
+
+    async def _run_in_thread(self, func, *args, request=False):
+        script_ctx = self._script_ctx
+
+        def call():
+            if script_ctx is not None:
+                add_script_run_ctx(threading.current_thread(), script_ctx)
+            # to_thread copies the context, so the worker is profiled as the calling stage
+            with stage_thread():
+                if not request:
+                    return func(*args)
+                # Waited for on the worker thread, so the event loop keeps running
+                with request_slot():
+                    return func(*args)
+
+        return await asyncio.to_thread(call)
+
+    async def read(self, sheet_name, columns=None):
+        """Read a worksheet into a DataFrame (reference worksheets through the cache)
+
+        Args:
+            columns (list): Read only these columns of a non-reference worksheet
+        """
+        return await self._run_in_thread(load_sheet, sheet_name, self.sh, columns, request=True)
+
+    async def read_many(self, sheet_names, columns=None):
+        """Read several worksheets concurrently, returns {sheet name: DataFrame}
+
+        Args:
+            columns (dict): Optional {sheet name: columns to read}
+        """
+        columns = columns or {}
+        frames = await asyncio.gather(*(self.read(name, columns.get(name)) for name in sheet_names))
+        return dict(zip(sheet_names, frames))
+
+    async def append(self, data, sheet_name, success_msg):
+        """Append rows to a worksheet"""
+        return await self._run_in_thread(update_worksheet, data, sheet_name, success_msg, self.sh,
+                                         request=True)
+
+    async def call(self, func, *args):
+        """Run any other blocking gspread call, e.g. on a worksheet object"""
+        return await self._run_in_thread(func, *args, request=True)
+
+    async def transform(self, func, *args):
+        """Run a CPU transform off the event loop so pending requests keep progressing"""
+        return await self._run_in_thread(func, *args)
+
+
+def read_sheets(sh, sheet_names, columns=None):
+    """Blocking helper to read several worksheets concurrently"""
+    async def read_all():
+        return await AsyncSheetsIO(sh).read_many(sheet_names, columns)
+    return asyncio.run(read_all())
@@ -1,92 +1,153 @@
 import streamlit as st  # Streamlit for creating web apps
 import pandas as pd
-from gspread_pandas import Spread, Client
-from google.oauth2 import service_account
 from datetime import datetime  # For timestamps
-import ssl
-import traceback
-import auction_processor as auction_p  # Renamed to avoid namespace conflict
-import eleven_processor as ep
-import naver_processor as naver_p  # Renamed to avoid namespace conflict 
-import coupang_processor as cp
-import always_processor as always_p  # Renamed to avoid namespace conflict
-from common_processor import read_naver_excel
-from delivery_view import load_and_process_data
-ssl._create_default_https_context = ssl._create_unverified_context
-
-scope = ['https://spreadsheets.google.com/feeds',
-         'https://www.googleapis.com/auth/drive']
-
-credentials = service_account.Credentials.from_service_account_info(
-                st.secrets["gcp_service_account"], scopes = scope)
-
-client = Client(scope=scope, creds=credentials)
-spreadsheetname = "원본 데이터"  # Name of our Google Sheet
-spread = Spread(spreadsheetname, client=client)
-sh = client.open(spreadsheetname)
-worksheet_list = sh.worksheets()
-
-# Initialize session state for tracking processing status if not already present
-if 'processing_complete' not in st.session_state:
-    st.session_state.processing_complete = False
-
-# Platform selection dropdown
+import os
+import json
+from platforms import PLATFORMS, detect_platform
+from progress import render_progress, render_previews
+from journal import list_unfinished
+from archive import DEFAULT_HORIZON_DAYS
+from jobs import enqueue, load_job, list_jobs, active_run_ids
+from worker import start_worker_thread
+from export import list_exports
+from profiling import list_profiles, profile_archive
+from demand import get_demand
+from common_processor import get_delivery_date
+from tenants import DEFAULT_TENANT, load_tenants, set_tenant
+
+# Worker threads started inside the app server; set to 0 when separate worker.py processes run
+EMBEDDED_WORKERS = int(os.environ.get('EMBEDDED_WORKERS', 1))
+
+@st.cache_resource
+def start_embedded_workers():
+    return [start_worker_thread() for _ in range(EMBEDDED_WORKERS)]
+
+@st.cache_data(max_entries=6)
+def load_profile_archive(path):
+    """Profiles do not change once saved, so each is zipped once"""
+    return profile_archive(path)
+
+def render_job_status(job):
+    status = job.job['status']
+    if status == 'queued':
+        st.info(f"Job {job.job['id']} is waiting for a worker")
+    elif status == 'failed':
+        st.error(f"Job {job.job['id']} failed: {job.job['error']}")
+
+@st.fragment(run_every=1)
+def live_progress(job_id):
+    """Poll the queued job and rerun the page once it has finished"""
+    job = load_job(job_id)
+    render_job_status(job)
+    render_progress(job)
+    if not job.running:
+        st.rerun()
+
+start_embedded_workers()
+
+# Store whose spreadsheets this page works on; one instance serves all configured stores
+tenants = load_tenants()
+tenant = st.sidebar.selectbox("Store", list(tenants), format_func=lambda name: tenants[name]['label'],
+                              disabled=len(tenants) == 1)
+set_tenant(tenant)
+
+# Platform selection dropdown; by default the platform is detected from the file's header
+AUTO_DETECT = "Auto-detect"
 platform = st.selectbox(
     "Select Platform",
-    ["11번가", "네이버/스토어", "쿠팡", "올웨이즈", "옥션/지마켓"]
+    [AUTO_DETECT] + list(PLATFORMS)
 )
 
+# Intermediate DataFrame previews are only collected when enabled
+verbose = st.sidebar.toggle("Show DataFrame previews", value=False)
+profile = st.sidebar.toggle("Profile runs", value=False, help="Record CPU and memory hot spots of each stage")
+
 # File uploader
 uploaded_file = st.file_uploader("Upload Excel File", type=["xlsx", "xls"], key="file_uploader")
 
 # Process the uploaded file
 if uploaded_file is not None:
-    try:        
-        
-        if platform == "11번가":
-            df = pd.read_excel(uploaded_file, header=1)
-            ep.process_eleven_customer(df, sh, spread)
-            ep.process_eleven_order(df, sh, spread)
-            ep.process_eleven_delivery(df, sh, spread)
-            st.session_state.processing_complete = True
-            
-        elif platform == "네이버/스토어":
-            df = read_naver_excel(uploaded_file)
-            naver_p.process_naver_customer(df, sh, spread)
-            naver_p.process_naver_order(df, sh, spread)
-            naver_p.process_naver_delivery(df, sh, spread)
-            st.session_state.processing_complete = True
-            
-        elif platform == "쿠팡":
-            df = pd.read_excel(uploaded_file)
-            cp.process_coupang_customer(df, sh, spread)
-            cp.process_coupang_order(df, sh, spread) 
-            cp.process_coupang_delivery(df, sh, spread)
-            st.session_state.processing_complete = True
-            
-        elif platform == "올웨이즈":
-            df = pd.read_excel(uploaded_file)
-            always_p.process_always_customer(df, sh, spread)
-            always_p.process_always_order(df, sh, spread)
-            always_p.process_always_delivery(df, sh, spread)
-            st.session_state.processing_complete = True
-            
-        elif platform == "옥션/지마켓":
-            df = pd.read_excel(uploaded_file)
-            auction_p.process_auction_customer(df, sh, spread)
-            auction_p.process_auction_order(df, sh, spread)
-            auction_p.process_auction_delivery(df, sh, spread)
-            st.session_state.processing_complete = True
-            
-        if st.session_state.processing_complete:
-            load_and_process_data()
-            st.success("Processing complete! Please upload another file if needed.")
-            # Reset the processing flag
-            st.session_state.processing_complete = False
-
-    except Exception as e:
-        st.error(f"Error processing file: {str(e)}")
-        st.error(f"Full error traceback:\n{traceback.format_exc()}")
-        st.session_state.processing_complete = False
+    # Queue a job once per uploaded file; reruns of the page only poll its progress
+    if st.session_state.get('run_file_id') != uploaded_file.file_id:
+        # Checked before queueing, so a wrong choice is rejected without parsing the file
+        detected = detect_platform(uploaded_file.getvalue())
+        if platform == AUTO_DETECT and detected is None:
+            st.error("Could not detect the platform of this file, please select it")
+        elif platform != AUTO_DETECT and detected is not None and detected != platform:
+            st.error(f"This looks like a {detected} export, not {platform}")
+        else:
+            st.session_state.job_id = enqueue(
+                'upload', {'platform': detected if platform == AUTO_DETECT else platform,
+                           'file_name': uploaded_file.name, 'tenant': tenant, 'profile': profile},
+                payload=uploaded_file.getvalue(), verbose=verbose)
+            st.session_state.run_file_id = uploaded_file.file_id
+
+# Move old 주문/배송 rows out of the live sheets
+with st.sidebar.expander("Archive old rows"):
+    horizon_days = st.number_input("Keep days", min_value=1, value=DEFAULT_HORIZON_DAYS)
+    archive_target = st.radio("Archive to", ["parquet", "sheet"], horizontal=True)
+    if st.button("Archive now"):
+        st.session_state.job_id = enqueue('archive', {'horizon_days': horizon_days, 'target': archive_target,
+                                                     'tenant': tenant}, verbose=verbose)
+
+# Courier upload files and picking lists written by recent runs
+with st.sidebar.expander("Courier exports"):
+    export_paths = list_exports()
+    if not export_paths:
+        st.caption("No exports yet")
+    for path in export_paths:
+        with open(path, 'rb') as f:
+            st.download_button(os.path.basename(path), f.read(), file_name=os.path.basename(path), key=path)
+
+# CPU and memory profiles of profiled runs
+with st.sidebar.expander("Profiles"):
+    profile_paths = list_profiles()
+    if not profile_paths:
+        st.caption("No profiles yet")
+    for path in profile_paths:
+        st.download_button(os.path.basename(path), load_profile_archive(path),
+                           file_name=f'{os.path.basename(path)}.zip', key=path)
+
+# Pick totals per SKU from the demand aggregate, no recompute of the delivery view
+with st.sidebar.expander("SKU demand"):
+    ship_date = st.date_input("출고 날짜", value=pd.to_datetime(get_delivery_date()))
+    demand_df = get_demand(ship_date.strftime('%Y-%m-%d'))
+    if demand_df.empty:
+        st.caption("No shipments recorded for this date")
+    else:
+        st.dataframe(demand_df.pivot_table(index=['SKU key', 'SKU 이름'], columns='플랫폼', values='수량',
+                                           aggfunc='sum', fill_value=0, margins=True, margins_name='합계'))
+
+# Jobs of all users of this store, so staff can see what the workers are busy with
+with st.sidebar.expander("Jobs"):
+    recent_jobs = [job for job in list_jobs(limit=50)
+                   if json.loads(job['args']).get('tenant', DEFAULT_TENANT) == tenant][:10]
+    if recent_jobs:
+        st.dataframe([{'id': job['id'], 'kind': job['kind'], 'status': job['status'],
+                       'created': job['created_at']} for job in recent_jobs], hide_index=True)
+    else:
+        st.caption("No jobs yet")
+
+job_id = st.session_state.get('job_id')
+
+# Failed or interrupted runs can be resumed without uploading the file again
+busy_runs = active_run_ids()
+for manifest in list_unfinished():
+    if manifest['run_id'] in busy_runs:
+        continue
+    label = f"Resume {manifest['file_name']} ({manifest['platform']}, {manifest['created_at']})"
+    if st.sidebar.button(label, key=f"resume_{manifest['run_id']}"):
+        job_id = enqueue('resume', {'run_id': manifest['run_id'], 'tenant': tenant, 'profile': profile},
+                         verbose=verbose)
+        st.session_state.job_id = job_id
+
+job = load_job(job_id, with_previews=True) if job_id is not None else None
+if job is not None:
+    if job.running:
+        live_progress(job_id)
+    else:
+        render_job_status(job)
+        render_progress(job)
+        render_previews(job)
 else:
     st.info("Please upload an Excel file to process")
@@ -0,0 +1,63 @@
+import os
+import contextvars
+import streamlit as st
+
+DEFAULT_TENANT = 'default'
+
+# Local state of tenants other than the default one lives under <TENANTS_DIR>/<tenant>/
+TENANTS_DIR = 'tenants'
+
+# Used when the secrets define no [tenants] table, i.e. a single-store deployment
+_DEFAULT_CONFIG = {
+    'label': '기본',
+    'source': '원본 데이터',
+    'dest': '데이터 종합',
+    # Share of the account's request quota, an equal part when unset (see quota.tenant_share)
+    'requests_per_minute': None,
+}
+
+# Tenant the current run or page works for
+_current_tenant = contextvars.ContextVar('current_tenant', default=DEFAULT_TENANT)
+
+
+def load_tenants():
+    """
+    Tenant configs from the [tenants] table of the Streamlit secrets
+
+        [tenants.store_a]
+        label = "A 스토어"
+        source = "원본 데이터 A"
+        dest = "데이터 종합 A"
+        requests_per_minute = 30
+
+    requests_per_minute is the tenant's share of the service account's
+    quota; all tenants together never exceed the account rate.
+
+    Returns:
+        dict: Tenant name -> config with label, source, dest and requests_per_minute
+    """
+    try:
+        configured = st.secrets.get('tenants')
+    except FileNotFoundError:
+        configured = None
+    if not configured:
+        return {DEFAULT_TENANT: dict(_DEFAULT_CONFIG)}
+    return {name: {**_DEFAULT_CONFIG, 'label': name, **config} for name, config in configured.items()}
+
+def set_tenant(name):
+    """Make name the tenant of the current context"""
+    if name not in load_tenants():
+        raise KeyError(f"Unknown tenant: {name}")
+    _current_tenant.set(name)
+
+def current_tenant():
+    """Name of the tenant the current context works for"""
+    return _current_tenant.get()
+
+def tenant_config():
+    return load_tenants()[current_tenant()]
+
+def tenant_path(path):
+    """Local state path of the current tenant; the default tenant keeps the unscoped paths"""
+    name = current_tenant()
+    return path if name == DEFAULT_TENANT else os.path.join(TENANTS_DIR, name, path)
@@ -0,0 +1,38 @@
+import pandas as pd
+from backfill import merge_rows, new_rows
+
+
+def orders(*lines):
+    return pd.DataFrame(lines, columns=['주문 key', '옵션 key'])
+
+def test_new_rows_keeps_every_line_of_an_order():
+    rows = new_rows([orders(('100_쿠팡', 'o1'), ('100_쿠팡', 'o2'), ('101_쿠팡', 'o1'))],
+                    ['주문 key'], orders())
+
+    assert rows.values.tolist() == [['100_쿠팡', 'o1'], ['100_쿠팡', 'o2'], ['101_쿠팡', 'o1']]
+
+def test_new_rows_takes_a_key_from_the_first_file_only():
+    first = orders(('100_쿠팡', 'o1'), ('100_쿠팡', 'o2'))
+    second = orders(('100_쿠팡', 'o1'), ('102_쿠팡', 'o3'), ('102_쿠팡', 'o4'))
+
+    rows = new_rows([first, second], ['주문 key'], orders(('102_쿠팡', 'o3')))
+
+    assert rows.values.tolist() == [['100_쿠팡', 'o1'], ['100_쿠팡', 'o2']]
+
+def test_merge_rows_dedupes_each_stage_by_its_keys():
+    file_rows = [{
+        'customer': pd.DataFrame({'고객 휴대폰': ['010-1111-2222'], '플랫폼': ['쿠팡']}),
+        'order': orders(('100_쿠팡', 'o1'), ('100_쿠팡', 'o2')),
+        'delivery': pd.DataFrame({'배송 key': ['배송_100_쿠팡'] * 2, '주문 key': ['100_쿠팡'] * 2}),
+    }] * 2
+    existing = {
+        'customer': pd.DataFrame({'고객 휴대폰': ['010-1111-2222'], '플랫폼': ['네이버']}),
+        'order': orders(),
+        'delivery': pd.DataFrame(columns=['배송 key']),
+    }
+
+    merged = merge_rows(file_rows, existing)
+
+    assert len(merged['customer']) == 1
+    assert len(merged['order']) == 2
+    assert len(merged['delivery']) == 2
@@ -0,0 +1,25 @@
+import pandas as pd
+import progress
+from demand import get_demand, update_demand
+
+OPTION_SKU = pd.DataFrame({'옵션 key': ['o1', 'o2'], 'SKU key': ['s1', 's2'], 'SKU 수량': ['1', '1']})
+SKU = pd.DataFrame({'SKU key': ['s1', 's2'], 'SKU 이름': ['사과', '배']})
+
+
+def test_lines_of_an_order_are_counted_once(tmp_path):
+    orders = pd.DataFrame({'주문 key': ['100_쿠팡', '100_쿠팡'], '옵션 key': ['o1', 'o2'],
+                           '주문 수량': ['1', '2'], '플랫폼': ['쿠팡', '쿠팡']})
+    # One delivery row per order line
+    deliveries = pd.DataFrame({'배송 key': ['배송_100_쿠팡'] * 2, '주문 key': ['100_쿠팡'] * 2,
+                               '출고 날짜': ['2024-05-02'] * 2})
+    reporter = progress.RunReporter()
+    token = progress._current_reporter.set(reporter)
+    try:
+        applied = update_demand(deliveries, orders, OPTION_SKU, SKU, db_path=str(tmp_path / 'demand.db'))
+    finally:
+        progress._current_reporter.reset(token)
+
+    assert applied == 1
+    assert reporter.events[-1][2].endswith('- 1 건')
+    demand = get_demand('2024-05-02', db_path=str(tmp_path / 'demand.db'))
+    assert demand[['SKU key', '수량']].values.tolist() == [['s1', 1], ['s2', 2]]
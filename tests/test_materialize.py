@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+import materialize
+from fake_sheets import FakeWorkbook
+from materialize import (changed_keys, covering_keys, load_state, refresh_fingerprints,
+                         save_state, upsert_rows)
+
+HEADER = ['배송 key', 'SKU 이름']
+
+
+def view(*rows):
+    workbook = FakeWorkbook({'배송': [HEADER] + [list(row) for row in rows]})
+    return workbook, workbook.worksheet('배송')
+
+def upsert(worksheet, *rows):
+    values = worksheet.get_all_values()
+    existing = pd.DataFrame(values[1:], columns=values[0])
+    return upsert_rows(worksheet, existing, pd.DataFrame(rows, columns=HEADER), '배송 key')
+
+
+def test_upsert_appends_updates_and_leaves_identical_rows():
+    _, worksheet = view(('k1', '사과'), ('k2', '배'))
+
+    counts = upsert(worksheet, ('k1', '사과'), ('k2', '귤'), ('k3', '감'))
+
+    assert counts == {'appended': 1, 'updated': 1, 'deleted': 0, 'unchanged': 1}
+    assert worksheet.values[1:] == [['k1', '사과'], ['k2', '귤'], ['k3', '감']]
+
+def test_upsert_deletes_absorbed_rows_in_one_request():
+    workbook, worksheet = view(('k1', '사과'), ('x', '배'), ('k2', '사과'), ('k3', '사과'))
+    requests = workbook.request_count
+
+    counts = upsert(worksheet, ('k1\nk2\nk3', '사과'))
+
+    assert counts == {'appended': 0, 'updated': 1, 'deleted': 2, 'unchanged': 0}
+    assert worksheet.values[1:] == [['k1\nk2\nk3', '사과'], ['x', '배']]
+    # get_all_values, one batch_update for the rewrite and one for both deletes
+    assert workbook.request_count - requests == 3
+
+def test_upsert_refuses_to_drop_keys_of_a_partly_recomputed_row():
+    _, worksheet = view(('k3\nk4', '사과'))
+
+    with pytest.raises(ValueError, match='k4'):
+        upsert(worksheet, ('k3', '사과'))
+    assert worksheet.values[1:] == [['k3\nk4', '사과']]
+
+def test_upsert_of_covering_keys_keeps_every_key():
+    _, worksheet = view(('k3\nk4', '사과'), ('k5', '배'))
+    assert covering_keys(pd.Series(['k3\nk4', 'k5']), ['k3']) == {'k3', 'k4'}
+
+    counts = upsert(worksheet, ('k3\nk4', '귤'))
+
+    assert counts['updated'] == 1
+    assert worksheet.values[1:] == [['k3\nk4', '귤'], ['k5', '배']]
+
+
+def test_changed_keys_are_new_or_different():
+    assert changed_keys({'a': '1', 'b': '2', 'c': '3'}, {'a': '1', 'b': '9'}) == ['b', 'c']
+
+def test_refresh_fingerprints_moves_current_keys_last():
+    known = {'old': '0', 'a': '1', 'b': '1', 'c': '1'}
+    current = {'a': '1', 'c': '2', 'd': '3', 'b': '5'}
+
+    refreshed = refresh_fingerprints(known, current, recomputed=['c', 'd'])
+
+    # b changed but was not recomputed, so it is dropped and recomputed next time
+    assert list(refreshed.items()) == [('old', '0'), ('a', '1'), ('c', '2'), ('d', '3')]
+
+def test_save_state_trims_least_recently_refreshed_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr(materialize, 'MAX_STATE_KEYS', 2)
+    path = str(tmp_path / 'state.json')
+    assert load_state(path) == {'reference': None, 'deliveries': {}}
+
+    deliveries = refresh_fingerprints({'a': '1', 'b': '1', 'c': '1'}, {'a': '1'}, recomputed=[])
+    save_state({'reference': 'r', 'deliveries': deliveries}, path)
+
+    assert load_state(path) == {'reference': 'r', 'deliveries': {'c': '1', 'a': '1'}}
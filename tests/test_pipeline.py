@@ -0,0 +1,25 @@
+import pandas as pd
+import progress
+from fake_sheets import FakeWorkbook
+from journal import Journal
+from pipeline import replay_stage
+
+
+def test_replay_skips_rows_an_earlier_attempt_already_wrote(tmp_path):
+    sh = FakeWorkbook({'고객': [['고객 휴대폰', '플랫폼', '고객 key'], ['010-1', '쿠팡', 'c1']]})
+    journal = Journal.create('쿠팡', 'a.xlsx', pd.DataFrame(), journal_dir=str(tmp_path))
+    customers = pd.DataFrame({'고객 휴대폰': ['010-1', '010-2'], '플랫폼': ['쿠팡', '쿠팡'],
+                              '고객 key': ['c1', 'c2']})
+    # Journaled, then appended (only the first row had made it) before the attempt crashed
+    journal.record('customer', customers, '고객', '고객 추가 완료', None)
+
+    token = progress._current_reporter.set(progress.RunReporter())
+    try:
+        replayed = replay_stage(journal, 'customer', sh)
+    finally:
+        progress._current_reporter.reset(token)
+
+    assert sh.worksheet('고객').values[1:] == [['010-1', '쿠팡', 'c1'], ['010-2', '쿠팡', 'c2']]
+    pd.testing.assert_frame_equal(replayed, customers)
+    assert journal.status('customer') == 'committed'
+    pd.testing.assert_frame_equal(journal.output('customer'), customers)
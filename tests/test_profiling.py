@@ -0,0 +1,28 @@
+import asyncio
+import profiling
+from fake_sheets import FakeWorkbook
+from profiling import Profiler
+from sheets_io import AsyncSheetsIO
+
+
+def busy():
+    total = 0
+    for i in range(3_000_000):
+        total += i
+    return total
+
+
+def test_transform_threads_are_sampled_as_the_calling_stage():
+    profiler = Profiler('test', interval=0.002)
+    token = profiling._current_profiler.set(profiler)
+    profiler.start()
+    try:
+        with profiler.stage('delivery_view'):
+            asyncio.run(AsyncSheetsIO(FakeWorkbook({})).transform(busy))
+    finally:
+        profiler.stop()
+        profiling._current_profiler.reset(token)
+
+    assert {stage for stage, _ in profiler.stacks} == {'delivery_view'}
+    assert any(name == 'busy' for _, stack in profiler.stacks for _, _, name in stack)
+    assert profiler.threads == {}
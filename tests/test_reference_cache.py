@@ -0,0 +1,84 @@
+import pytest
+import common_processor
+import reference_cache
+from fake_sheets import FakeWorkbook
+from reference_cache import get_reference_sheet
+
+
+class RecordingWorkbook(FakeWorkbook):
+    """FakeWorkbook remembering the ranges of every batchGet"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ranges = []
+
+    def values_batch_get(self, ranges, params=None):
+        self.ranges.append(list(ranges))
+        return super().values_batch_get(ranges, params)
+
+
+def workbook():
+    return RecordingWorkbook({
+        '옵션': [['옵션 key', '상품 id', '옵션 id', '옵션 할인금액']]
+                + [[f'o{i}', f'p{i}', f'p{i}_빨강', '0'] for i in range(20)],
+        '주문': [['주문 key'], ['1_쿠팡']],
+    })
+
+def full_fetches(sh):
+    """batchGets that downloaded whole used columns of 옵션 beyond the first"""
+    return [ranges for ranges in sh.ranges if "'옵션'!D:D" in ranges]
+
+def upload(sh):
+    sh.worksheet('주문').append_rows([['2_쿠팡']])
+
+def edit(sh, cell, value):
+    sh.worksheet('옵션').batch_update([{'range': cell, 'values': [[value]]}])
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(common_processor, '_headers', {})
+    monkeypatch.setattr(reference_cache, '_modified_times', {})
+    monkeypatch.setattr(reference_cache, 'MODIFIED_TIME_TTL', 0)
+
+
+def test_unchanged_spreadsheet_is_served_without_sheet_requests(tmp_path):
+    sh = workbook()
+    get_reference_sheet('옵션', sh, cache_dir=tmp_path)
+    requests = len(sh.ranges)
+
+    df = get_reference_sheet('옵션', sh, cache_dir=tmp_path)
+
+    assert len(sh.ranges) == requests
+    assert len(df) == 20
+
+def test_upload_to_another_worksheet_only_probes(tmp_path):
+    sh = workbook()
+    get_reference_sheet('옵션', sh, cache_dir=tmp_path)
+    upload(sh)
+
+    df = get_reference_sheet('옵션', sh, cache_dir=tmp_path)
+
+    assert len(full_fetches(sh)) == 1
+    assert df['옵션 key'].tolist() == [f'o{i}' for i in range(20)]
+
+def test_appended_and_edited_last_rows_are_fetched(tmp_path):
+    sh = workbook()
+    get_reference_sheet('옵션', sh, cache_dir=tmp_path)
+
+    edit(sh, 'D21', '500')
+    assert get_reference_sheet('옵션', sh, cache_dir=tmp_path)['옵션 할인금액'].iloc[-1] == '500'
+
+    sh.worksheet('옵션').append_rows([['o20', 'p20', 'p20_빨강', '0']])
+    assert get_reference_sheet('옵션', sh, cache_dir=tmp_path)['옵션 key'].iloc[-1] == 'o20'
+    assert len(full_fetches(sh)) == 3
+
+def test_edits_the_probe_misses_are_fetched_after_the_refresh_interval(tmp_path, monkeypatch):
+    sh = workbook()
+    get_reference_sheet('옵션', sh, cache_dir=tmp_path)
+    edit(sh, 'D4', '700')
+
+    assert get_reference_sheet('옵션', sh, cache_dir=tmp_path)['옵션 할인금액'].iloc[2] == '0'
+
+    monkeypatch.setattr(reference_cache, 'FULL_REFRESH_SECONDS', 0)
+    upload(sh)
+    assert get_reference_sheet('옵션', sh, cache_dir=tmp_path)['옵션 할인금액'].iloc[2] == '700'
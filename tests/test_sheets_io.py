@@ -0,0 +1,122 @@
+import asyncio
+import threading
+import pandas as pd
+import pytest
+import progress
+import common_processor
+import quota
+from fake_sheets import FakeWorkbook
+from sheets_io import AsyncSheetsIO, read_sheets
+
+
+def workbook(latency=0.0):
+    return FakeWorkbook({
+        '옵션': [['옵션 key', '상품 id', '옵션 id', '옵션 할인금액'],
+                 ['o1', 'p1', 'p1_빨강', '100'], ['o2', 'p2', 'p2_파랑', '0']],
+        '주문': [['주문 key', '옵션 key', '주문 수량'], ['1_쿠팡', 'o1', '2']],
+        '배송': [['배송 key', '주문 key'], ['배송_1_쿠팡', '1_쿠팡']],
+    }, latency)
+
+
+class CountingWorkbook(FakeWorkbook):
+    """FakeWorkbook recording the most requests that were in flight at once"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.count_lock = threading.Lock()
+
+    def _simulate_request(self):
+        with self.count_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            super()._simulate_request()
+        finally:
+            with self.count_lock:
+                self.in_flight -= 1
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The reference cache and history store write under the working directory
+    monkeypatch.chdir(tmp_path)
+    # Every FakeWorkbook has the same id, so resolved headers must not carry over
+    monkeypatch.setattr(common_processor, '_headers', {})
+
+@pytest.fixture
+def reporter():
+    reporter = progress.RunReporter()
+    token = progress._current_reporter.set(reporter)
+    yield reporter
+    progress._current_reporter.reset(token)
+
+
+def test_read_many_returns_every_sheet():
+    sh = workbook()
+    frames = asyncio.run(AsyncSheetsIO(sh).read_many(['옵션', '주문', '배송'],
+                                                     columns={'주문': ['주문 key', '주문 수량']}))
+
+    assert list(frames) == ['옵션', '주문', '배송']
+    assert frames['옵션']['옵션 key'].tolist() == ['o1', 'o2']
+    assert list(frames['주문'].columns) == ['주문 key', '주문 수량']
+    assert frames['배송'].values.tolist() == [['배송_1_쿠팡', '1_쿠팡']]
+
+def test_read_sheets_matches_read_many():
+    sh = workbook()
+    frames = read_sheets(sh, ['주문', '배송'])
+    expected = asyncio.run(AsyncSheetsIO(sh).read_many(['주문', '배송']))
+
+    for name in ('주문', '배송'):
+        pd.testing.assert_frame_equal(frames[name], expected[name])
+
+def test_append_adds_rows_after_existing(reporter):
+    sh = workbook()
+    rows = pd.DataFrame({'주문 key': ['2_쿠팡', '3_쿠팡'], '옵션 key': ['o2', None], '주문 수량': [1, 3]})
+
+    written = asyncio.run(AsyncSheetsIO(sh).append(rows, '주문', '주문 추가 완료'))
+
+    assert written is rows
+    assert sh.worksheet('주문').get_all_values()[1:] == [
+        ['1_쿠팡', 'o1', '2'], ['2_쿠팡', 'o2', '1'], ['3_쿠팡', '', '3']]
+    assert [(level, message) for _, level, message in reporter.events] == [('success', '주문 추가 완료')]
+
+def test_append_of_no_rows_writes_nothing(reporter):
+    sh = workbook()
+    asyncio.run(AsyncSheetsIO(sh).append(pd.DataFrame(columns=['주문 key']), '주문', 'unused'))
+
+    assert sh.request_count == 0
+    assert len(sh.worksheet('주문').get_all_values()) == 2
+    assert reporter.events[0][1] == 'info'
+
+def test_requests_in_flight_are_bounded_across_instances_and_loops():
+    sh = CountingWorkbook({'주문': [['주문 key'], ['1_쿠팡']]}, latency=0.02)
+
+    def read_in_own_loop():
+        read_sheets(sh, ['주문'] * 6, columns={'주문': ['주문 key']})
+
+    threads = [threading.Thread(target=read_in_own_loop) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sh.max_in_flight <= quota.MAX_CONCURRENCY
+    assert sh.max_in_flight > 1
+
+def test_nested_request_slots_share_the_outer_slot():
+    finished = []
+
+    def nested():
+        with quota.request_slot():
+            with quota.request_slot():
+                finished.append(True)
+
+    threads = [threading.Thread(target=nested) for _ in range(quota.MAX_CONCURRENCY * 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(finished) == len(threads)
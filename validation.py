@@ -0,0 +1,116 @@
+import pandas as pd
+
+# Phone numbers as exported by the platforms: optional hyphens, masked digits allowed
+PHONE_PATTERN = r'^\+?[0-9*]{2,4}-?[0-9*]{3,4}-?[0-9*]{4}$'
+
+# Columns each platform's processors read from an upload
+#   order_id: rows with an empty order id are dropped by the processors, not reported
+#   required: every column that must be present
+#   keys: columns that must not be empty
+#   numeric: amounts and quantities, '1,000' style allowed
+#   phones: phone number columns, empty allowed unless also listed in keys
+PLATFORM_SCHEMAS = {
+    "11번가": {
+        'order_id': '주문번호',
+        'required': ['주문번호', '휴대폰번호', '구매자ID', '구매자', '전화번호', '판매자기본할인금액',
+                     '판매자 추가할인금액', '상품번호', '옵션', '주문일시', '결제일시', '주문금액',
+                     '서비스이용료', '정산예정금액', '배송비', '수량', '주소', '우편번호', '배송메시지', '수취인'],
+        'keys': ['휴대폰번호', '상품번호', '주소'],
+        'numeric': ['판매자기본할인금액', '판매자 추가할인금액', '주문금액', '서비스이용료',
+                    '정산예정금액', '배송비', '수량'],
+        'phones': ['휴대폰번호', '전화번호'],
+    },
+    "네이버/스토어": {
+        'order_id': '주문번호',
+        'required': ['주문번호', '구매자연락처', '구매자ID', '구매자명', '상품가격', '옵션가격', '수량',
+                     '상품번호', '옵션정보', '주문일시', '결제일', '네이버페이 주문관리 수수료',
+                     '매출연동 수수료', '정산예정금액', '배송비 합계', '사은품', '주문상태', '통합배송지',
+                     '우편번호', '배송메세지', '배송방법', '수취인연락처1', '수취인연락처2', '수취인명'],
+        'keys': ['구매자연락처', '상품번호', '통합배송지'],
+        'numeric': ['상품가격', '옵션가격', '수량', '네이버페이 주문관리 수수료', '매출연동 수수료',
+                    '정산예정금액', '배송비 합계'],
+        'phones': ['구매자연락처', '수취인연락처1', '수취인연락처2'],
+    },
+    "쿠팡": {
+        'order_id': '주문번호',
+        'required': ['주문번호', '구매자전화번호', '구매자', '옵션ID', '등록옵션명', '결제액', '주문일',
+                     '배송비', '구매수(수량)', '수취인 주소', '우편번호', '배송메세지', '수취인전화번호',
+                     '수취인이름'],
+        'keys': ['구매자전화번호', '옵션ID', '수취인 주소'],
+        'numeric': ['결제액', '배송비', '구매수(수량)'],
+        'phones': ['구매자전화번호', '수취인전화번호'],
+    },
+    "올웨이즈": {
+        'order_id': '주문아이디',
+        'required': ['주문아이디', '수령인 연락처', '수령인', '올웨이즈 부담 쿠폰할인금',
+                     '판매자 부담 쿠폰할인금', '상품아이디', '옵션', '주문 시점', '상품가격',
+                     '정산대상금액(수수료 제외)', '배송비', '수량', '주소', '우편번호', '공동현관 비밀번호',
+                     '수령 방법'],
+        'keys': ['수령인 연락처', '상품아이디', '주소'],
+        'numeric': ['올웨이즈 부담 쿠폰할인금', '판매자 부담 쿠폰할인금', '상품가격',
+                    '정산대상금액(수수료 제외)', '배송비', '수량'],
+        'phones': ['수령인 연락처'],
+    },
+    "옥션/지마켓": {
+        'order_id': '주문번호',
+        'required': ['주문번호', '구매자 휴대폰', '구매자아이디', '구매자명', '구매자 전화번호',
+                     '판매자쿠폰할인', '구매쿠폰적용금액', '우수회원할인', '상품번호', '옵션',
+                     '주문일자(결제확인전)', '결제일', '판매금액', '서비스이용료', '정산예정금액',
+                     '배송비 금액', '수량', '사은품', '주소', '우편번호', '배송시 요구사항', '수령인 휴대폰',
+                     '수령인 전화번호', '수령인명'],
+        'keys': ['구매자 휴대폰', '상품번호', '주소'],
+        'numeric': ['판매자쿠폰할인', '구매쿠폰적용금액', '우수회원할인', '판매금액', '서비스이용료',
+                    '정산예정금액', '배송비 금액', '수량'],
+        'phones': ['구매자 휴대폰', '구매자 전화번호', '수령인 휴대폰', '수령인 전화번호'],
+    },
+}
+
+
+def _cleaned(values):
+    """String values as the processors see them: stripped, 'nan' treated as empty"""
+    return values.astype(str).str.strip().replace('nan', '')
+
+def validate_upload(df, platform, header_row=0):
+    """
+    Check an uploaded frame against the platform's schema without any network I/O
+
+    Args:
+        df (pandas.DataFrame): Upload as read by read_upload
+        platform (str): Platform name as shown in the app
+        header_row (int): 0-indexed header row, used to report Excel row numbers
+
+    Returns:
+        pandas.DataFrame: One row per problem with the Excel row ('행', empty for
+            missing columns), column ('열'), problem ('문제') and value ('값').
+            Empty when the upload is valid.
+    """
+    schema = PLATFORM_SCHEMAS[platform]
+    missing = [col for col in schema['required'] if col not in df.columns]
+    if missing:
+        return pd.DataFrame({'행': '', '열': missing, '문제': 'missing column', '값': ''})
+
+    rows = df[_cleaned(df[schema['order_id']]) != '']
+    # Excel rows are 1-based and the data starts below the header row
+    excel_rows = rows.index.to_series() + header_row + 2
+
+    problems = []
+    def add(column, mask, problem, values):
+        if mask.any():
+            problems.append(pd.DataFrame({'행': excel_rows[mask], '열': column,
+                                          '문제': problem, '값': values[mask]}))
+
+    for col in schema['keys']:
+        values = _cleaned(rows[col])
+        add(col, values == '', 'empty key', values)
+    for col in schema['numeric']:
+        values = _cleaned(rows[col])
+        parsed = pd.to_numeric(values.str.replace(',', ''), errors='coerce')
+        add(col, (values != '') & parsed.isna(), 'not a number', values)
+    for col in schema['phones']:
+        values = _cleaned(rows[col])
+        invalid = ~values.str.replace(' ', '').str.match(PHONE_PATTERN)
+        add(col, (values != '') & invalid, 'invalid phone number', values)
+
+    if not problems:
+        return pd.DataFrame(columns=['행', '열', '문제', '값'])
+    return pd.concat(problems, ignore_index=True).sort_values(['행', '열'], kind='stable')
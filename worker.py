@@ -0,0 +1,156 @@
+"""
+Worker process for queued jobs
+
+Run one or more next to the app to process uploads outside the Streamlit
+server:
+
+    python worker.py --processes 2
+"""
+import io
+import json
+import argparse
+import threading
+import functools
+import contextvars
+import multiprocessing
+from platforms import PLATFORMS, read_upload, detect_platform
+from connections import open_spreadsheet
+from pipeline import run_journaled_upload
+from progress import notify, preview, run_reported
+from validation import validate_upload
+from journal import Journal
+from archive import rollover_sheets
+from profiling import run_profiled
+from tenants import DEFAULT_TENANT, set_tenant, tenant_config
+from jobs import (JobReporter, claim_next, finish_job, heartbeat, requeue_stale, set_run_id,
+                  worker_name)
+
+POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 15
+
+
+def process_upload(job, platform, file_name):
+    """
+    Read the uploaded file and run the pipeline, resuming when the job is retried
+
+    Without a platform (unattended ingestion) it is detected from the file's header.
+    """
+    if job['run_id']:
+        notify('info', "Resuming the interrupted run of this upload")
+        sh, spread = open_spreadsheet(tenant_config()['source'])
+        return report_run(*run_journaled_upload(Journal(job['run_id']), sh, spread))
+
+    if platform is None:
+        platform = detect_platform(job['payload'])
+        if platform is None:
+            notify('error', f"Could not detect the platform of {file_name}, nothing was uploaded")
+            return False
+        notify('info', f"Detected platform: {platform}")
+
+    df = read_upload(platform, io.BytesIO(job['payload']))
+
+    # Fail fast before any sheet is read or written
+    report = validate_upload(df, platform, header_row=PLATFORMS[platform].get('header', 0))
+    if not report.empty:
+        notify('error', f"{len(report)} problems found in the uploaded file, nothing was uploaded")
+        preview("Validation report", report, always=True)
+        return False
+
+    sh, spread = open_spreadsheet(tenant_config()['source'])
+    journal = Journal.create(platform, file_name, df)
+    set_run_id(job['id'], journal.run_id)
+    return report_run(*run_journaled_upload(journal, sh, spread))
+
+def resume_upload(job, run_id):
+    """Resume a failed or interrupted run from its journal"""
+    sh, spread = open_spreadsheet(tenant_config()['source'])
+    set_run_id(job['id'], run_id)
+    return report_run(*run_journaled_upload(Journal(run_id), sh, spread))
+
+def archive_rows(job, horizon_days, target):
+    sh, _ = open_spreadsheet(tenant_config()['source'])
+    rollover_sheets(sh, horizon_days, target)
+
+def report_run(values, statuses, errors):
+    """Summarize the stage results of a run, False when a stage failed"""
+    for stage_name, error in errors.items():
+        notify('error', f"Error in {stage_name} stage: {str(error)}")
+    skipped = [name for name, status in statuses.items() if status == 'skipped']
+    if skipped:
+        notify('info', f"No new rows, skipped: {', '.join(skipped)}")
+    if not errors:
+        notify('success', "Processing complete! Please upload another file if needed.")
+    return not errors
+
+# Job kind -> handler called with the job and its JSON arguments; False marks the job failed
+JOB_HANDLERS = {
+    'upload': process_upload,
+    'resume': resume_upload,
+    'archive': archive_rows,
+}
+
+
+def run_handler(job, args):
+    """Run a job's handler for the tenant in its 'tenant' argument, profiled when 'profile' is set"""
+    set_tenant(args.pop('tenant', DEFAULT_TENANT))
+    profile = args.pop('profile', False)
+    handler = functools.partial(JOB_HANDLERS[job['kind']], job, **args)
+    return run_profiled(f"job-{job['id']}-{job['kind']}", profile, handler)
+
+def run_job(job):
+    """Run a claimed job with its progress persisted, and record how it ended"""
+    reporter = JobReporter(job['id'], verbose=bool(job['verbose']))
+    stopped = threading.Event()
+
+    def keep_alive():
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            heartbeat(job['id'])
+
+    threading.Thread(target=keep_alive, daemon=True).start()
+    try:
+        succeeded = contextvars.copy_context().run(run_reported, reporter, run_handler,
+                                                   job, json.loads(job['args']))
+    finally:
+        stopped.set()
+    if reporter.error is not None:
+        finish_job(job['id'], error=str(reporter.error))
+    else:
+        finish_job(job['id'], error=None if succeeded is not False else "Run did not complete")
+
+def work(stop=None, poll_interval=POLL_INTERVAL):
+    """
+    Process queued jobs until stop is set
+
+    Any number of workers, threads or processes, can share the queue;
+    each job is claimed by exactly one of them.
+    """
+    stop = stop or threading.Event()
+    name = worker_name()
+    while not stop.is_set():
+        requeue_stale()
+        job = claim_next(name)
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        run_job(job)
+
+def start_worker_thread():
+    """Run a worker inside the current process, e.g. next to the Streamlit server"""
+    thread = threading.Thread(target=work, daemon=True, name='job-worker')
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Process queued upload jobs")
+    parser.add_argument('--processes', type=int, default=1, help="Worker processes to start")
+    options = parser.parse_args()
+
+    if options.processes == 1:
+        work()
+    else:
+        workers = [multiprocessing.Process(target=work) for _ in range(options.processes)]
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()